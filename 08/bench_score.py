@@ -0,0 +1,362 @@
+"""Benchmarks for the construction of the score web page.
+
+Usage: python bench_score.py BENCHMARK
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from jinja2 import Template
+from lark import Lark
+from pymupdf import Document as PdfDocument
+
+from cache import CoverCache, ParseCache, scan_fingerprints
+from catalog import Catalog
+from pipeline import build_archive
+from score import (ARCHIVE_HTML_TEMPLATE, GRAMMAR, RECORD_HTML_TEMPLATE,
+                   SCORE_HTML_TEMPLATE, CoverBatch, CoverGenerator, CoverSettings, Score,
+                   ScoreArchive, ScoreNameTransformer, ScoreRecord,
+                   discover_scores, html_environment, parse_score_name,
+                   parse_score_name_fast, score_name_parser)
+from search import SearchIndex
+
+SCORES_DIR = Path("../scores")
+
+SIZES = [1_000, 10_000, 100_000]
+
+# Synthetic data --------------------------------------------------------
+WORDS = ["Francisco", "Tárrega", "Johann", "Sebastian", "Bach", "Anónimo",
+         "Villa+Lobos", "Heitor", "Estudio", "Preludio", "Fantasía", "op",
+         "BWV", "998", "22", "Max", "Eschig", "Simrock", "da", "Milano"]
+
+def make_names(n: int, seed: int = 0) -> list[str]:
+    """Generate n synthetic score names."""
+    rng = random.Random(seed)
+    def words() -> str:
+        return "-".join(rng.choices(WORDS, k=rng.randint(1, 4)))
+    names = []
+    for _ in range(n):
+        fields = [words(), words()]
+        if rng.random() < 0.5:
+            fields.append(words())
+        names.append("_".join(fields))
+    return names
+
+def make_archive(n: int) -> ScoreArchive:
+    """Generate a ScoreArchive of n synthetic scores."""
+    scores = [Score(Path(f"{name}.pdf"), with_cover=False)
+              for name in make_names(n)]
+    return ScoreArchive.from_scores(scores)
+
+def make_scorearchive(n: int, seed: int = 0) -> ScoreArchive:
+    """Generate a ScoreArchive of n synthetic scores without parsing their
+    names: the names are made from the fields."""
+    rng = random.Random(seed)
+    def words() -> list[str]:
+        return rng.choices(WORDS, k=rng.randint(1, 4))
+    scorerecords = []
+    for i in range(n):
+        fields = [words(), words() + [str(i)]]
+        if rng.random() < 0.5:
+            fields.append(words())
+        name = "_".join("-".join(f) for f in fields)
+        composer, work, *editor = [" ".join(f).replace("+", "-")
+                                   for f in fields]
+        score = Score(Path(SCORES_DIR, f"{name}.pdf"), with_cover=False)
+        scorerecords.append(ScoreRecord(composer, work, "".join(editor),
+                                        score))
+    return ScoreArchive(scorerecords)
+
+# Utils -----------------------------------------------------------------
+def timed(f, *args) -> float:
+    """Return the seconds taken by f(*args)."""
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+def report(label: str, n: int, seconds: float, unit: str = "name") -> None:
+    print(f"{label:<28} {n:>9,} {unit}s {seconds:9.3f} s "
+          f"{seconds / n * 1e6:9.2f} µs/{unit}")
+
+def report_covers(label: str, covers: list[Path], seconds: float) -> None:
+    size = sum(c.stat().st_size for c in covers)
+    print(f"{label:<28} {len(covers):>4} covers "
+          f"{seconds / len(covers) * 1e3:8.1f} ms/cover "
+          f"{size / len(covers) / 1024:8.1f} KiB/cover")
+
+# Benchmarks ------------------------------------------------------------
+def bench_parse() -> None:
+    """Per-name parse cost: Earley parser per name vs shared LALR parser
+    vs fast path, up to millions of names."""
+    def earley_per_name(names):
+        for name in names:
+            tree = Lark(GRAMMAR, start="score").parse(name)
+            ScoreNameTransformer().transform(tree)
+    def shared_lalr(names):
+        parser = score_name_parser()
+        for name in names:
+            parser.parse(name)
+    def fast_path(names):
+        for name in names:
+            parse_score_name_fast(name)
+    def with_fallback(names):
+        for name in names:
+            parse_score_name(name)
+    # the old way is too slow for the given sizes: measure a sample
+    report("earley per name", 100, timed(earley_per_name, make_names(100)))
+    for n in SIZES:
+        report("shared lalr", n, timed(shared_lalr, make_names(n)))
+    for n in SIZES + [1_000_000, 3_000_000]:
+        names = make_names(n)
+        report("fast path", n, timed(fast_path, names))
+        report("fast path with fallback", n, timed(with_fallback, names))
+
+def bench_parse_cache() -> None:
+    """ScoreArchive of 100k scores, one in ten with a name the fast path
+    cannot parse: parsing every name vs those names memoized in the parse
+    cache, loaded from disk."""
+    n = 100_000
+    scores = [Score(Path(f"{name}-{i}.pdf" if i % 10
+                         else f"{name.replace('_', ' _ ')}-{i}.pdf"))
+              for i, name in enumerate(make_names(n))]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp, "names.json")
+        parse_cache = ParseCache(path)
+        report("parse and memoize", n, timed(ScoreArchive.from_scores,
+                                             scores, None, parse_cache))
+        parse_cache.save()
+        def memoized():
+            ScoreArchive.from_scores(scores, None, ParseCache.load(path))
+        report("parse", n, timed(ScoreArchive.from_scores, scores))
+        report("load and lookup", n, timed(memoized))
+        print(f"{len(parse_cache.entries)} names memoized, "
+              f"{path.stat().st_size / n:.1f} bytes/name on disk")
+
+def bench_covers() -> None:
+    """Render time and bytes per cover of the sample scores: default
+    pixmap vs size-targeted rendering."""
+    def default_pixmap(pdf, cover):
+        with PdfDocument(pdf) as document:
+            document.get_page_pixmap(0).save(cover)
+    def size_targeted(pdf, cover):
+        CoverGenerator(pdf, cover, CoverSettings()).render()
+    pdfs = sorted(SCORES_DIR.glob("*.pdf"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, render in [("default pixmap", default_pixmap),
+                              ("size-targeted 280x420", size_targeted)]:
+            covers = [Path(tmp, f"{label}-{pdf.stem}.png") for pdf in pdfs]
+            def render_all():
+                for pdf, cover in zip(pdfs, covers):
+                    render(pdf, cover)
+            report_covers(label, covers, timed(render_all))
+
+def bench_cover_formats() -> None:
+    """Render time and bytes per cover of the sample scores for each
+    cover format, colorspace and palette."""
+    variants = [
+        ("rgb png", ".png", CoverSettings()),
+        ("gray png", ".png", CoverSettings(colorspace="gray")),
+        ("gray 16 colors png", ".png", CoverSettings(colorspace="gray",
+                                                     colors=16)),
+        ("1-bit png", ".png", CoverSettings(colorspace="gray", colors=2)),
+        ("gray jpg q80", ".jpg", CoverSettings(colorspace="gray")),
+        ("gray webp q80", ".webp", CoverSettings(colorspace="gray")),
+        ("gray 16 colors webp", ".webp", CoverSettings(colorspace="gray",
+                                                       colors=16)),
+    ]
+    pdfs = sorted(SCORES_DIR.glob("*.pdf"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, suffix, settings in variants:
+            covers = [Path(tmp, f"{label}-{pdf.stem}{suffix}") for pdf in pdfs]
+            def render_all():
+                for pdf, cover in zip(pdfs, covers):
+                    CoverGenerator(pdf, cover, settings).render()
+            report_covers(label, covers, timed(render_all))
+
+def bench_render() -> None:
+    """Render cost of 10k records: a Template per call vs the shared
+    environment."""
+    n = 10_000
+    scorearchive = make_archive(n)
+    def template_per_record():
+        for sr in scorearchive:
+            Template(SCORE_HTML_TEMPLATE).render(scorerecord=sr)
+    def environment_per_record():
+        for sr in scorearchive:
+            sr.to_html()
+    def template_archive():
+        record = Template(RECORD_HTML_TEMPLATE)
+        Template(ARCHIVE_HTML_TEMPLATE).render(
+            scorearchive=scorearchive, offset=0,
+            render_record=lambda sr: record.render(scorerecord=sr))
+    def environment_archive():
+        scorearchive.to_html()
+    html_environment()   # compile outside of the measures
+    report("template per record", n, timed(template_per_record), "record")
+    report("environment per record", n, timed(environment_per_record),
+           "record")
+    report("template archive", n, timed(template_archive), "record")
+    report("environment archive", n, timed(environment_archive), "record")
+
+def bench_search() -> None:
+    """Build time and size of the search index of 100k records."""
+    n = 100_000
+    scorearchive = make_archive(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        searchindex = None
+        def build():
+            nonlocal searchindex
+            searchindex = SearchIndex.from_pages([("partituras.html",
+                                                   scorearchive)])
+        report("search index build", n, timed(build), "record")
+        written = []
+        def write():
+            written.extend(searchindex.write(Path(tmp)))
+        report("search index write", n, timed(write), "record")
+        sizes = sorted(p.stat().st_size for p in written)
+        print(f"{len(written)} files, {sum(sizes) / 1024:.1f} KiB, "
+              f"largest shard {sizes[-1] / 1024:.1f} KiB, "
+              f"{sum(sizes) / n:.1f} bytes/record")
+
+def bench_sort() -> None:
+    """Sort cost of 1M records: key function per sort vs precomputed
+    collation keys."""
+    n = 1_000_000
+    score = Score(Path("Anónimo_Greensleeves.pdf"), with_cover=False)
+    names = make_names(10_000)
+    fields = [parse_score_name(name) for name in names]
+    scorearchive = None
+    def build():
+        nonlocal scorearchive
+        scorearchive = ScoreArchive(
+            [ScoreRecord(**fields[i % len(fields)], score=score)
+             for i in range(n)])
+    def composer_and_work(sr):
+        composer_names = sr.composer.split(" ")
+        return (composer_names[-1], composer_names[:-1], sr.work)
+    report("records with collation keys", n, timed(build), "record")
+    def sort_with_key_function():
+        sorted(scorearchive, key=composer_and_work)
+    report("key function per sort", n, timed(sort_with_key_function),
+           "record")
+    report("collation keys", n, timed(scorearchive.sort), "record")
+    sorted_archive = scorearchive.sort()
+    extra = [ScoreRecord(**f, score=score) for f in fields[:1000]]
+    def insert():
+        for sr in extra:
+            sorted_archive.insert_sorted(sr)
+    report("insert_sorted", len(extra), timed(insert), "record")
+
+def bench_memory() -> None:
+    """Memory per record of a ScoreArchive of 1M synthetic scores."""
+    n = 1_000_000
+    tracemalloc.start()
+    scorearchive = make_scorearchive(n)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{len(scorearchive):,} records {size / 2**20:9.1f} MiB "
+          f"{size / n:9.1f} bytes/record")
+
+def bench_discovery() -> None:
+    """Discovery throughput on a tree of 100k files in 100 directories."""
+    n = 100_000
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, name in enumerate(make_names(n)):
+            directory = Path(tmp, f"{i % 100:02}")
+            directory.mkdir(exist_ok=True)
+            Path(directory, f"{name}-{i}.pdf").touch()
+        def discover():
+            for _ in discover_scores(Path(tmp), with_cover=False):
+                pass
+        def fingerprints():
+            scan_fingerprints(Path(tmp))
+        report("discover_scores", n, timed(discover), "file")
+        report("scan_fingerprints", n, timed(fingerprints), "file")
+
+def bench_pipeline() -> None:
+    """Build time of 20 copies of the sample scores: discovery, parsing
+    and cover rendering one after the other vs the asyncio pipeline."""
+    copies = 20
+    def staged(score_dir):
+        scores = list(discover_scores(score_dir))
+        scorearchive = ScoreArchive.from_scores(scores).sort()
+        CoverBatch.from_scores((sr.score for sr in scorearchive),
+                               CoverCache(Path("covers.json"))).run(jobs=0)
+    def pipelined(score_dir):
+        asyncio.run(build_archive(score_dir, cache=CoverCache(
+            Path("covers.json")), concurrency=8))
+    with tempfile.TemporaryDirectory() as tmp:
+        pdfs = sorted(SCORES_DIR.glob("*.pdf"))
+        for i in range(copies):
+            directory = Path(tmp, "scores", f"{i:02}")
+            directory.mkdir(parents=True)
+            for pdf in pdfs:
+                shutil.copy(pdf, directory / f"{pdf.stem}-{i}.pdf")
+        n = copies * len(pdfs)
+        cwd = Path.cwd()
+        for label, build in [("stages one after the other", staged),
+                             ("asyncio pipeline", pipelined)]:
+            workdir = Path(tmp, label)
+            workdir.mkdir()
+            try:
+                os.chdir(workdir)
+                report(label, n, timed(build, Path(tmp, "scores")), "score")
+            finally:
+                os.chdir(cwd)
+
+def bench_catalog() -> None:
+    """Catalog of 100k scores: bulk upsert, finding the changed scores vs
+    parsing them all, prefix query and page written from the cursor vs
+    from memory."""
+    n = 100_000
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, name in enumerate(make_names(n)):
+            Path(tmp, f"{name}-{i}.pdf").touch()
+        scorearchive = ScoreArchive.from_scores(
+            discover_scores(Path(tmp))).sort()
+        with Catalog.open(Path(tmp, "catalog.sqlite")) as catalog:
+            report("bulk upsert", n, timed(catalog.upsert, scorearchive),
+                   "record")
+            report("upsert again", n, timed(catalog.upsert, scorearchive),
+                   "record")
+            scores = [sr.score for sr in scorearchive]
+            report("find changed", n, timed(catalog.changed, scores),
+                   "record")
+            report("parse all again", n,
+                   timed(ScoreArchive.from_scores, scores), "record")
+            matches = catalog.count(composer="Tárrega")
+            report("prefix query", matches,
+                   timed(list, catalog.select(composer="Tárrega")), "record")
+            report("select all", n, timed(list, catalog.select()), "record")
+            report("page from memory", n, timed(scorearchive.write_html,
+                                                Path(tmp, "memory.html")),
+                   "record")
+            report("page from cursor", n, timed(catalog.write_html,
+                                                Path(tmp, "cursor.html")),
+                   "record")
+
+BENCHMARKS = {
+    "parse": bench_parse,
+    "parse-cache": bench_parse_cache,
+    "covers": bench_covers,
+    "cover-formats": bench_cover_formats,
+    "render": bench_render,
+    "search": bench_search,
+    "sort": bench_sort,
+    "memory": bench_memory,
+    "discovery": bench_discovery,
+    "pipeline": bench_pipeline,
+    "catalog": bench_catalog,
+}
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("benchmark", choices=BENCHMARKS)
+    args = argparser.parse_args()
+    BENCHMARKS[args.benchmark]()
@@ -0,0 +1,374 @@
+import hashlib
+import json
+import os
+import shutil
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing_extensions import Self # in >3.10: from typing ...
+
+from discovery import walk_files
+
+CHUNK_SIZE = 1 << 20
+PARSE_CACHE_SIZE = 1 << 18
+
+def file_digest(path: Path) -> str:
+    """Return the SHA-256 hex digest of the content of path."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_json(path: Path, default):
+    """Load the JSON document in path, or default if it is missing or
+    corrupt."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+@contextmanager
+def atomic_open(path: Path, mode: str = "w", **kwargs) -> Iterator:
+    """Open a temporary file next to path that replaces path when closed
+    without errors, so readers never see a half-written file."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(tmp, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+def dump_json(path: Path, data) -> None:
+    """Write data as JSON to path atomically."""
+    with atomic_open(path, encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+@dataclass(frozen=True)
+class Fingerprint:
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def of(cls, path: Path) -> Self:
+        """Construct the Fingerprint of the file in path."""
+        st = path.stat()
+        return cls(st.st_size, st.st_mtime_ns)
+
+def scan_fingerprints(directory: Path) -> dict[str, Fingerprint]:
+    """Return the Fingerprint of each score in directory and its
+    subdirectories, keyed by path."""
+    fingerprints = {}
+    for entry in walk_files(directory):
+        st = entry.stat()
+        fingerprints[entry.path] = Fingerprint(st.st_size, st.st_mtime_ns)
+    return fingerprints
+
+@dataclass
+class CoverCache:
+    """Index of the rendered covers, keyed by cover path.
+
+    Each entry records the pdf it was rendered from, the pdf fingerprint
+    and content digest, the render settings, and what was read from the
+    pdf while rendering (placeholder and metadata). A cover is fresh when
+    the fingerprint is unchanged (fast path) or, failing that, when the
+    content digest is unchanged. A cover that is not fresh can be copied
+    from that of another pdf with the same digest, so renamed, moved or
+    copied pdfs are not rendered again."""
+    index: Path
+    entries: dict[str, dict] = field(default_factory=dict)
+    by_size: dict[int, set[str]] = field(default_factory=dict, init=False,
+                                         repr=False)
+
+    def __post_init__(self):
+        for cover, entry in self.entries.items():
+            self.by_size.setdefault(entry["size"], set()).add(cover)
+
+    @classmethod
+    def load(cls, index: Path) -> Self:
+        """Construct the CoverCache from the given index file."""
+        return cls(index, load_json(index, {}))
+
+    def save(self) -> None:
+        """Write the CoverCache to its index file."""
+        dump_json(self.index, self.entries)
+
+    def is_fresh(self, pdf: Path, cover: Path, settings: str = "") -> bool:
+        """Whether cover exists and was rendered from the current content
+        of pdf with the given settings."""
+        entry = self.entries.get(str(cover))
+        if (entry is None or entry["pdf"] != str(pdf)
+                or entry["settings"] != settings or not cover.exists()):
+            return False
+        fingerprint = Fingerprint.of(pdf)
+        if [entry["size"], entry["mtime_ns"]] == [fingerprint.size,
+                                                  fingerprint.mtime_ns]:
+            return True
+        if entry["digest"] != file_digest(pdf):
+            return False
+        entry["size"] = fingerprint.size
+        entry["mtime_ns"] = fingerprint.mtime_ns
+        return True
+
+    def update(self, pdf: Path, cover: Path, settings: str = "",
+               placeholder: str = "", pdfinfo: dict | None = None) -> None:
+        """Record that cover has just been rendered from pdf."""
+        fingerprint = Fingerprint.of(pdf)
+        self.entries[str(cover)] = {
+            "pdf": str(pdf),
+            "size": fingerprint.size,
+            "mtime_ns": fingerprint.mtime_ns,
+            "digest": file_digest(pdf),
+            "settings": settings,
+            "placeholder": placeholder,
+            "pdfinfo": pdfinfo,
+        }
+        self.by_size.setdefault(fingerprint.size, set()).add(str(cover))
+
+    def reuse(self, covers: Iterable[tuple[Path, Path]],
+              settings: str = "") -> set[Path]:
+        """Copy to each (pdf, cover) of covers the cover rendered with the
+        given settings from a pdf with the same content, if any, and
+        return the covers reused.
+
+        Only the pdfs sharing their size with an indexed one are
+        hashed."""
+        reused = set()
+        for pdf, cover in covers:
+            fingerprint = Fingerprint.of(pdf)
+            # a copy, as covers may be rendered and updated meanwhile
+            candidates = list(self.by_size.get(fingerprint.size, ()))
+            if not candidates:
+                continue
+            digest = file_digest(pdf)
+            for source in candidates:
+                entry = self.entries.get(source)
+                if (entry is None or entry["settings"] != settings
+                        or entry["size"] != fingerprint.size
+                        or entry["digest"] != digest
+                        or not Path(source).exists()):
+                    continue
+                if source != str(cover):
+                    cover.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copyfile(source, cover)
+                self.entries[str(cover)] = entry | {
+                    "pdf": str(pdf),
+                    "size": fingerprint.size,
+                    "mtime_ns": fingerprint.mtime_ns,
+                }
+                self.by_size[fingerprint.size].add(str(cover))
+                reused.add(cover)
+                break
+        return reused
+
+    def placeholder(self, cover: Path) -> str:
+        """Return the placeholder recorded for cover, if any."""
+        return self.entries.get(str(cover), {}).get("placeholder", "")
+
+    def pdfinfo(self, cover: Path) -> dict | None:
+        """Return the pdf metadata recorded with cover, if any."""
+        return self.entries.get(str(cover), {}).get("pdfinfo")
+
+    def collect_garbage(self, covers: Iterable[Path]) -> list[Path]:
+        """Delete the indexed covers not in covers and return them."""
+        alive = {str(c) for c in covers}
+        orphans = [Path(c) for c in self.entries if c not in alive]
+        for orphan in orphans:
+            orphan.unlink(missing_ok=True)
+            del self.entries[str(orphan)]
+        return orphans
+
+@dataclass
+class BuildManifest:
+    """Record of the last build, keyed by pdf path: the pdf fingerprint
+    and the fields parsed from its name, and a hash of the options of
+    the build.
+
+    A build with the same options whose score directory still matches
+    the manifest has nothing to do. The fields depend on the parser, so
+    the manifest is tied to a version of it: loading it with another
+    version starts empty."""
+    path: Path
+    entries: dict[str, dict] = field(default_factory=dict)
+    changed: bool = False
+    version: str = ""
+    options: str = ""
+
+    @classmethod
+    def load(cls, path: Path, version: str = "") -> Self:
+        """Construct the BuildManifest from the given file, if it was
+        written with the given version."""
+        data = load_json(path, {})
+        if data.get("version") != version:
+            return cls(path, version=version)
+        return cls(path, data["entries"], version=version,
+                   options=data.get("options", ""))
+
+    def save(self) -> None:
+        """Write the BuildManifest to its file if it has changed."""
+        if self.changed:
+            dump_json(self.path, {"version": self.version,
+                                  "options": self.options,
+                                  "entries": self.entries})
+            self.changed = False
+
+    def use_options(self, options: str) -> None:
+        """Record the hash of the options of this build."""
+        if options != self.options:
+            self.options = options
+            self.changed = True
+
+    def is_current(self, fingerprints: dict[str, Fingerprint],
+                   options: str = "") -> bool:
+        """Whether the given options hash is the one recorded, and the
+        given fingerprints, keyed by pdf path, are exactly the ones
+        recorded."""
+        if (options != self.options
+                or len(fingerprints) != len(self.entries)):
+            return False
+        for pdf, fingerprint in fingerprints.items():
+            entry = self.entries.get(pdf)
+            if (entry is None or entry["size"] != fingerprint.size
+                    or entry["mtime_ns"] != fingerprint.mtime_ns):
+                return False
+        return True
+
+    def lookup(self, pdf: Path) -> dict | None:
+        """Return the fields recorded for pdf, or None if pdf is new or
+        has changed since."""
+        entry = self.entries.get(str(pdf))
+        if entry is None:
+            return None
+        fingerprint = Fingerprint.of(pdf)
+        if [entry["size"], entry["mtime_ns"]] != [fingerprint.size,
+                                                  fingerprint.mtime_ns]:
+            return None
+        return entry["fields"]
+
+    def record(self, pdf: Path, fields: dict | None) -> None:
+        """Record the fields parsed for pdf, None if its name could not be
+        parsed (so it is parsed again next time)."""
+        fingerprint = Fingerprint.of(pdf)
+        self.entries[str(pdf)] = {
+            "size": fingerprint.size,
+            "mtime_ns": fingerprint.mtime_ns,
+            "fields": fields,
+        }
+        self.changed = True
+
+    def prune(self, pdfs: Iterable[Path]) -> list[Path]:
+        """Forget the recorded pdfs not in pdfs and return them."""
+        alive = {str(p) for p in pdfs}
+        removed = [Path(p) for p in self.entries if p not in alive]
+        for pdf in removed:
+            del self.entries[str(pdf)]
+        self.changed = self.changed or bool(removed)
+        return removed
+
+    def forget(self, pdfs: Iterable[Path]) -> None:
+        """Forget the given pdfs, so the next build handles them again."""
+        for pdf in pdfs:
+            if self.entries.pop(str(pdf), None) is not None:
+                self.changed = True
+
+@dataclass
+class ParseCache:
+    """Memo of the fields parsed from score names, keyed by name, kept on
+    disk between builds. Only the names the fast path cannot parse are
+    memoized, since parsing the rest is quicker than looking them up.
+
+    It holds at most max_entries names: the least recently used are
+    dropped first. Like the BuildManifest, it is tied to a version of the
+    parser: loading it with another version starts empty."""
+    path: Path
+    version: str = ""
+    max_entries: int = PARSE_CACHE_SIZE
+    entries: dict[str, dict] = field(default_factory=dict)
+    changed: bool = False
+
+    @classmethod
+    def load(cls, path: Path, version: str = "",
+             max_entries: int = PARSE_CACHE_SIZE) -> Self:
+        """Construct the ParseCache from the given file, if it was written
+        with the given version."""
+        data = load_json(path, {})
+        if data.get("version") != version:
+            return cls(path, version, max_entries)
+        return cls(path, version, max_entries, data["entries"])
+
+    def save(self) -> None:
+        """Write the ParseCache to its file if names were added."""
+        if self.changed:
+            dump_json(self.path, {"version": self.version,
+                                  "entries": self.entries})
+            self.changed = False
+
+    def get(self, name: str) -> dict | None:
+        """Return the fields memoized for name, if any."""
+        fields = self.entries.pop(name, None)
+        if fields is not None:
+            self.entries[name] = fields   # the most recently used last
+        return fields
+
+    def put(self, name: str, fields: dict) -> None:
+        """Memoize the fields parsed from name, dropping the least
+        recently used names beyond max_entries."""
+        self.entries.pop(name, None)
+        self.entries[name] = fields
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+        self.changed = True
+
+@dataclass
+class FragmentCache:
+    """HTML fragments rendered in former builds, keyed by a hash of what
+    they show, kept on disk between builds.
+
+    It is tied to a version of the template of the fragments: loading it
+    with another version starts empty. Only the fragments used in a
+    build are saved, so the cache does not grow beyond the archive."""
+    path: Path
+    version: str = ""
+    entries: dict[str, str] = field(default_factory=dict)
+    used: dict[str, str] = field(default_factory=dict, repr=False)
+    hits: int = 0
+    misses: int = 0
+
+    @classmethod
+    def load(cls, path: Path, version: str = "") -> Self:
+        """Construct the FragmentCache from the given file, if it was
+        written with the given version."""
+        data = load_json(path, {})
+        if data.get("version") != version:
+            return cls(path, version)
+        return cls(path, version, data["entries"])
+
+    def save(self) -> None:
+        """Write the fragments used to the file, if any changed. A cache
+        that was not used is kept as it is."""
+        if not self.hits + self.misses:
+            return
+        if self.misses or len(self.used) != len(self.entries):
+            dump_json(self.path, {"version": self.version,
+                                  "entries": self.used})
+
+    def get(self, key: str) -> str | None:
+        """Return the fragment of key, if any."""
+        fragment = self.used.get(key) or self.entries.get(key)
+        if fragment is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.used[key] = fragment
+        return fragment
+
+    def put(self, key: str, fragment: str) -> None:
+        """Keep the fragment just rendered for key."""
+        self.used[key] = fragment
+
+    def hit_rate(self) -> float:
+        """Return the fraction of the fragments found in the cache."""
+        return self.hits / ((self.hits + self.misses) or 1)
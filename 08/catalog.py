@@ -0,0 +1,231 @@
+import json
+import sqlite3
+from collections.abc import Iterable, Iterator
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing_extensions import Self # in >3.10: from typing ...
+
+from jinja2 import Environment
+
+from cache import (BuildManifest, Fingerprint, FragmentCache, ParseCache,
+                   atomic_open)
+from score import (HTML_BUFFER_SIZE, ParseFailure, PdfInfo, Score,
+                   ScoreArchive, ScoreRecord, collate, html_environment,
+                   record_context)
+
+CATALOG = Path("catalog.sqlite")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS scores (
+        path TEXT PRIMARY KEY,
+        composer TEXT NOT NULL,
+        work TEXT NOT NULL,
+        editor TEXT NOT NULL,
+        surname_key TEXT NOT NULL,
+        first_names_key TEXT NOT NULL,
+        work_key TEXT NOT NULL,
+        editor_key TEXT NOT NULL,
+        cover TEXT,
+        placeholder TEXT NOT NULL DEFAULT '',
+        pdfinfo TEXT,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL
+    );
+    DROP INDEX IF EXISTS scores_order;
+    CREATE INDEX IF NOT EXISTS scores_sort ON scores (
+        surname_key, first_names_key, work_key, composer, work, editor_key,
+        editor, path);
+    CREATE INDEX IF NOT EXISTS scores_work ON scores (work_key);
+    CREATE INDEX IF NOT EXISTS scores_editor ON scores (editor_key);
+    """
+
+COLUMNS = ("path, composer, work, editor, surname_key, first_names_key, "
+           "work_key, editor_key, cover, placeholder, pdfinfo")
+
+UPSERT = """
+    INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (path) DO UPDATE SET
+        composer = excluded.composer,
+        work = excluded.work,
+        editor = excluded.editor,
+        surname_key = excluded.surname_key,
+        first_names_key = excluded.first_names_key,
+        work_key = excluded.work_key,
+        editor_key = excluded.editor_key,
+        cover = excluded.cover,
+        placeholder = excluded.placeholder,
+        pdfinfo = excluded.pdfinfo,
+        size = excluded.size,
+        mtime_ns = excluded.mtime_ns
+    """
+
+# the order of ScoreArchive.sort
+ORDER = ("surname_key, first_names_key, work_key, composer, work, "
+         "editor_key, editor, path")
+
+# the columns searched by prefix for each field, all of them indexed
+PREFIX_COLUMNS = {"composer": "surname_key", "work": "work_key",
+                  "editor": "editor_key"}
+
+@dataclass
+class Catalog:
+    """SQLite store of the ScoreRecord, keyed by pdf path: the fields
+    parsed from the name, their collation keys, the cover and what was
+    read from the pdf, and the pdf fingerprint.
+
+    Records are selected in page order (the order of ScoreArchive.sort)
+    through an index, optionally by prefix of the composer surname, the
+    work or the editor, and yielded from the cursor, so pages can be
+    written without loading the whole catalog. The fingerprints tell
+    the records to build again from those to read as they are."""
+    connection: sqlite3.Connection
+
+    @classmethod
+    def open(cls, path: Path = CATALOG) -> Self:
+        """Open the Catalog in path, creating it if needed."""
+        connection = sqlite3.connect(path)
+        connection.executescript(SCHEMA)
+        return cls(connection)
+
+    def close(self) -> None:
+        """Close the connection to the Catalog."""
+        self.connection.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def row(sr: ScoreRecord) -> tuple:
+        """Return the row of the ScoreRecord. The cover is NULL if it is
+        the default one, which saves building paths when reading."""
+        s = sr.score
+        fingerprint = Fingerprint.of(s.path)
+        cover = None if s.cover == Score(s.path).cover else str(s.cover)
+        pdfinfo = s.pdfinfo and json.dumps(asdict(s.pdfinfo),
+                                           ensure_ascii=False)
+        return (str(s.path), sr.composer, sr.work, sr.editor,
+                *sr.collation_key[:3], collate(sr.editor), cover,
+                s.placeholder, pdfinfo, fingerprint.size,
+                fingerprint.mtime_ns)
+
+    @staticmethod
+    def record(row: tuple) -> ScoreRecord:
+        """Construct the ScoreRecord of a row of COLUMNS."""
+        (path, composer, work, editor, surname_key, first_names_key,
+         work_key, editor_key, cover, placeholder, pdfinfo) = row
+        s = Score(Path(path))
+        if cover is not None:
+            s.cover = Path(cover)
+        s.placeholder = placeholder
+        s.pdfinfo = pdfinfo and PdfInfo(**json.loads(pdfinfo))
+        return ScoreRecord(composer, work, editor, s,
+                           (surname_key, first_names_key, work_key,
+                            composer, work, editor_key, editor))
+
+    def upsert(self, scorerecords: Iterable[ScoreRecord]) -> None:
+        """Insert the ScoreRecord, or update them if their pdf is already
+        in the Catalog, in a single transaction."""
+        with self.connection:
+            self.connection.executemany(UPSERT, map(self.row, scorerecords))
+
+    def changed(self, scores: Iterable[Score]) -> list[Score]:
+        """Return the scores whose pdf is not in the Catalog or has
+        changed since it was recorded."""
+        recorded = {path: Fingerprint(size, mtime_ns)
+                    for path, size, mtime_ns in self.connection.execute(
+                        "SELECT path, size, mtime_ns FROM scores")}
+        return [s for s in scores
+                if recorded.get(str(s.path)) != Fingerprint.of(s.path)]
+
+    def add_scores(self, scores: Iterable[Score],
+                   manifest: BuildManifest | None = None,
+                   parse_cache: ParseCache | None = None,
+                   failures: list[ParseFailure] | None = None
+                   ) -> ScoreArchive:
+        """Construct the ScoreArchive of the given scores changed since
+        they were recorded, like ScoreArchive.from_scores, and upsert its
+        records. The rest are left as they are in the Catalog."""
+        scorearchive = ScoreArchive.from_scores(self.changed(scores),
+                                                manifest, parse_cache,
+                                                failures)
+        self.upsert(scorearchive)
+        return scorearchive
+
+    def prune(self, pdfs: Iterable[Path]) -> int:
+        """Delete the records whose pdf is not in pdfs and return how
+        many."""
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS alive "
+                                    "(path TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM alive")
+            self.connection.executemany("INSERT OR IGNORE INTO alive "
+                                        "VALUES (?)",
+                                        ((str(p),) for p in pdfs))
+            cursor = self.connection.execute(
+                "DELETE FROM scores "
+                "WHERE path NOT IN (SELECT path FROM alive)")
+        return cursor.rowcount
+
+    def forget(self, pdfs: Iterable[Path]) -> None:
+        """Delete the records of the given pdfs, so the next build
+        handles them again."""
+        with self.connection:
+            self.connection.executemany("DELETE FROM scores WHERE path = ?",
+                                        ((str(p),) for p in pdfs))
+
+    @staticmethod
+    def where(prefixes: dict[str, str]) -> tuple[str, list[str]]:
+        """Return the WHERE clause, and its parameters, selecting the
+        records whose fields start with the given prefixes. The prefixes
+        are collated, so they ignore case and accents, and a composer
+        prefix is matched against the surname."""
+        clauses, parameters = [], []
+        for name, prefix in prefixes.items():
+            if not prefix:
+                continue
+            column = PREFIX_COLUMNS[name]
+            # an index range: prefix <= key < prefix + the last character
+            clauses.append(f"{column} >= ? AND {column} < ?")
+            parameters += [collate(prefix), collate(prefix) + "\U0010ffff"]
+        if not clauses:
+            return "", []
+        return "WHERE " + " AND ".join(clauses), parameters
+
+    def count(self, **prefixes: str) -> int:
+        """Return the number of records matching the prefixes."""
+        where, parameters = self.where(prefixes)
+        cursor = self.connection.execute(
+            f"SELECT COUNT(*) FROM scores {where}", parameters)
+        return cursor.fetchone()[0]
+
+    def select(self, limit: int = -1, offset: int = 0,
+               **prefixes: str) -> Iterator[ScoreRecord]:
+        """Yield the ScoreRecord matching the prefixes in page order,
+        skipping offset records and yielding at most limit (all if -1),
+        as they are fetched."""
+        where, parameters = self.where(prefixes)
+        cursor = self.connection.execute(
+            f"SELECT {COLUMNS} FROM scores {where} "
+            f"ORDER BY {ORDER} LIMIT ? OFFSET ?", [*parameters, limit, offset])
+        for row in cursor:
+            yield self.record(row)
+
+    def write_html(self, path: Path, environment: Environment | None = None,
+                   search: str = "",
+                   fragment_cache: FragmentCache | None = None,
+                   **prefixes: str) -> None:
+        """Write the records matching the prefixes as an HTML page to
+        path, like ScoreArchive.write_html, rendering them from the
+        cursor."""
+        environment = environment or html_environment()
+        template = environment.get_template("archive.html")
+        stream = template.stream(scorearchive=self.select(**prefixes),
+                                 search=search, offset=0,
+                                 **record_context(environment,
+                                                  fragment_cache))
+        stream.enable_buffering(HTML_BUFFER_SIZE)
+        with atomic_open(path, encoding="utf-8") as f:
+            stream.dump(f)
@@ -0,0 +1,27 @@
+import os
+from collections.abc import Iterator
+from pathlib import Path
+
+SCORE_SUFFIXES = (".pdf",)
+
+def walk_files(directory: Path,
+               suffixes: tuple[str, ...] = SCORE_SUFFIXES
+               ) -> Iterator[os.DirEntry]:
+    """Yield the files in directory and its subdirectories whose suffix is
+    one of suffixes (in any case), skipping hidden files and directories.
+
+    Directories are walked depth-first with os.scandir, one at a time,
+    and the files are yielded as they are found."""
+    pending = [os.fspath(directory)]
+    while pending:
+        subdirectories = []
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif (entry.is_file()
+                      and entry.name.lower().endswith(suffixes)):
+                    yield entry
+        pending.extend(reversed(subdirectories))
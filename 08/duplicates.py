@@ -0,0 +1,98 @@
+import base64
+from collections import defaultdict
+from collections.abc import Iterable
+
+try:
+    import numpy
+except ImportError:     # near duplicates need NumPy
+    numpy = None
+from pymupdf import Pixmap
+
+from cache import file_digest
+from score import Score
+
+HASH_SIZE = 8
+NEAR_DISTANCE = 6
+
+def find_duplicates(scores: Iterable[Score]) -> list[list[Score]]:
+    """Return the groups of scores whose pdf have the same content, each
+    group sorted by path.
+
+    Only the pdfs sharing their size with another one are hashed, so
+    most pdfs are only stat'ed."""
+    by_size = defaultdict(list)
+    for s in scores:
+        by_size[s.path.stat().st_size].append(s)
+    groups = []
+    for candidates in by_size.values():
+        if len(candidates) < 2:
+            continue
+        by_digest = defaultdict(list)
+        for s in candidates:
+            by_digest[file_digest(s.path)].append(s)
+        groups.extend(sorted(group, key=lambda s: str(s.path))
+                      for group in by_digest.values() if len(group) > 1)
+    return sorted(groups, key=lambda group: str(group[0].path))
+
+def share_covers(duplicates: list[list[Score]]) -> None:
+    """Give the scores of each group of duplicates the cover of the first
+    one, so it is rendered and cached once."""
+    for first, *copies in duplicates:
+        for s in copies:
+            s.cover = first.cover
+
+def perceptual_hash(placeholder: str) -> int:
+    """Return the difference hash of a cover from its placeholder: a bit
+    per pixel of a HASH_SIZE x HASH_SIZE thumbnail, set if the pixel is
+    darker than the one below it. Similar covers have hashes differing
+    in few bits. Needs NumPy."""
+    png = base64.b64decode(placeholder.partition(",")[2])
+    pixmap = Pixmap(png)
+    pixels = numpy.frombuffer(pixmap.samples, numpy.uint8).reshape(
+        pixmap.height, pixmap.width, pixmap.n)[:, :, 0]
+    rows = numpy.linspace(0, pixmap.height - 1, HASH_SIZE + 1).round()
+    columns = numpy.linspace(0, pixmap.width - 1, HASH_SIZE).round()
+    thumbnail = pixels[numpy.ix_(rows.astype(int), columns.astype(int))]
+    bits = thumbnail[:-1] < thumbnail[1:]
+    return int.from_bytes(numpy.packbits(bits).tobytes(), "big")
+
+def hamming_distances(h: int, hashes: "numpy.ndarray") -> "numpy.ndarray":
+    """Return the number of bits each of hashes differs from h in."""
+    differences = (hashes ^ numpy.uint64(h)).view(numpy.uint8)
+    return numpy.unpackbits(differences).reshape(len(hashes), -1).sum(axis=1)
+
+def find_near_duplicates(scores: Iterable[Score],
+                         max_distance: int = NEAR_DISTANCE
+                         ) -> list[tuple[Score, Score, int]]:
+    """Return the pairs of scores whose covers look alike, with the
+    number of bits their perceptual hashes differ in, at most
+    max_distance (less than HASH_SIZE). Scores without placeholder are
+    ignored, and of those sharing a cover only the first is compared.
+    Needs NumPy.
+
+    The hashes are split into max_distance + 1 bands of a byte, so two
+    near hashes share at least one band, and only the scores sharing a
+    band are compared, each one against the rest at once."""
+    firsts = {}
+    for s in scores:
+        if s.placeholder:
+            firsts.setdefault(s.cover, s)
+    scores = list(firsts.values())
+    hashes = numpy.array([perceptual_hash(s.placeholder) for s in scores],
+                         dtype=numpy.uint64)
+    bands = hashes.view(numpy.uint8).reshape(-1, HASH_SIZE)
+    pairs = {}
+    for band in range(min(HASH_SIZE, max_distance + 1)):
+        buckets = defaultdict(list)
+        for i, value in enumerate(bands[:, band].tolist()):
+            buckets[value].append(i)
+        for bucket in buckets.values():
+            bucket = numpy.array(bucket)
+            for k, i in enumerate(bucket[:-1].tolist()):
+                rest = bucket[k + 1:]
+                distances = hamming_distances(int(hashes[i]), hashes[rest])
+                near = distances <= max_distance
+                for j, d in zip(rest[near].tolist(),
+                                distances[near].tolist()):
+                    pairs[i, j] = d
+    return [(scores[i], scores[j], d) for (i, j), d in sorted(pairs.items())]
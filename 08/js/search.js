@@ -0,0 +1,84 @@
+// Client-side search of the score archive.
+//
+// The search index is made of an index file, listing the shards and the
+// pages of the archive, and a file per shard mapping the accent-folded
+// tokens of composer, work and editor to record ids. Shards are loaded
+// on demand, when a token of the query needs them.
+
+(function () {
+  const input = document.querySelector(".score-search input");
+  if (!input) return;
+  const results = document.querySelector(".score-search-results");
+  const indexUrl = input.dataset.index;
+  const baseUrl = indexUrl.slice(0, indexUrl.lastIndexOf("/") + 1);
+  const records = Array.from(document.querySelectorAll(".score-record"));
+  const shards = new Map();
+  let index = null;
+
+  function tokenize(s) {
+    const folded = s.normalize("NFKD").replace(/\p{M}/gu, "").toLowerCase();
+    return folded.match(/[\p{L}\p{N}]+/gu) || [];
+  }
+
+  function fetchJson(url) {
+    return fetch(url).then((response) => response.json());
+  }
+
+  function loadShard(prefix) {
+    if (!shards.has(prefix)) {
+      shards.set(prefix, fetchJson(baseUrl + "t-" + prefix + ".json"));
+    }
+    return shards.get(prefix);
+  }
+
+  // Ids of the records with a token starting with the given one.
+  async function lookup(token) {
+    index = index || await fetchJson(indexUrl);
+    const prefixes = index.shards.filter(
+      (p) => p.startsWith(token) || token.startsWith(p));
+    const found = new Set();
+    for (const shard of await Promise.all(prefixes.map(loadShard))) {
+      for (const [t, ids] of Object.entries(shard)) {
+        if (t.startsWith(token)) ids.forEach((id) => found.add(id));
+      }
+    }
+    return found;
+  }
+
+  function pageOf(id) {
+    let href = index.pages[0][0];
+    for (const [page, first] of index.pages) {
+      if (first > id) break;
+      href = page;
+    }
+    return href;
+  }
+
+  async function search(query) {
+    const tokens = tokenize(query);
+    if (tokens.length === 0) {
+      records.forEach((r) => { r.hidden = false; });
+      results.textContent = "";
+      return;
+    }
+    const sets = await Promise.all(tokens.map(lookup));
+    if (query !== input.value) return;   // a newer search is running
+    const ids = sets.reduce((a, b) => new Set([...a].filter((x) => b.has(x))));
+    records.forEach((r) => { r.hidden = !ids.has(Number(r.id.slice(6))); });
+    const here = new Set(records.map((r) => Number(r.id.slice(6))));
+    const elsewhere = new Map();
+    for (const id of ids) {
+      if (here.has(id)) continue;
+      const href = pageOf(id);
+      elsewhere.set(href, (elsewhere.get(href) || 0) + 1);
+    }
+    results.replaceChildren(...Array.from(elsewhere, ([href, count]) => {
+      const a = document.createElement("a");
+      a.href = href;
+      a.textContent = `${href} (${count})`;
+      return a;
+    }));
+  }
+
+  input.addEventListener("input", () => { search(input.value); });
+})();
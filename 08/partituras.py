@@ -1,12 +1,348 @@
+import argparse
+import asyncio
+import cProfile
+import hashlib
 import sys
+import time
 from pathlib import Path
 
-from score import Score, ScoreArchive
+from jinja2 import Environment
 
-if __name__ == "__main__":
-    scores = [Score(s) for s in Path(sys.argv[1]).iterdir()]
-    scorearchive = ScoreArchive.from_scores(scores).sort() 
-    html_page = scorearchive.to_html()
-    with open("partituras.html", "w") as f:
-        f.write(html_page)
+import duplicates
+from catalog import CATALOG, Catalog
+from cache import (BuildManifest, CoverCache, FragmentCache, ParseCache,
+                   dump_json, scan_fingerprints)
+from pipeline import build_archive
+from score import (BUILD_MANIFEST, COVERS_INDEX, FRAGMENT_CACHE,
+                   PARSE_CACHE, TEMPLATES, TEMPLATES_CACHE_DIR, CoverBatch,
+                   CoverSettings, ParseFailure, RenderLimits, Score,
+                   ScoreArchive, discover_scores, html_environment,
+                   manifest_version, parser_version, remove_shards,
+                   template_version)
+from search import SEARCH_DIR, SEARCH_INDEX, SearchIndex
+from timings import Timings
+
+OUTPUT = Path("partituras.html")
+FAILURES_REPORT = Path("cover-failures.json")
+DUPLICATES_REPORT = Path("duplicates.json")
+PARSE_FAILURES_REPORT = Path("name-failures.json")
+TIMINGS_REPORT = Path("timings.json")
+
+def cover_size(s: str) -> tuple[int, int]:
+    """Parse a cover size given as WxH."""
+    try:
+        width, height = map(int, s.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {s}")
+    return width, height
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line arguments."""
+    argparser = argparse.ArgumentParser(
+        description="Build partituras.html from a directory of scores.")
+    argparser.add_argument("score_dir", type=Path,
+                           help="directory of the pdf scores "
+                                "(and its subdirectories)")
+    argparser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                           help="processes rendering covers "
+                                "(default: 1, 0: one per CPU)")
+    argparser.add_argument("-f", "--force", action="store_true",
+                           help="build even if no score changed "
+                                "since the last build")
+    argparser.add_argument("--cover-size", type=cover_size, default="280x420",
+                           metavar="WxH",
+                           help="size of the covers in pixels "
+                                "(default: 280x420)")
+    argparser.add_argument("--cover-format", choices=[".png", ".jpg", ".webp"],
+                           default=".png",
+                           help="image format of the covers (default: .png)")
+    argparser.add_argument("--cover-gray", action="store_true",
+                           help="render grayscale covers")
+    argparser.add_argument("--cover-colors", type=int, default=0, metavar="N",
+                           help="quantize covers to N colors, 2 for 1-bit "
+                                "(needs Pillow)")
+    argparser.add_argument("--cover-quality", type=int, default=80,
+                           metavar="Q",
+                           help="quality of .jpg and .webp covers "
+                                "(default: 80)")
+    argparser.add_argument("--cover-timeout", type=float, default=60,
+                           metavar="SECONDS",
+                           help="give up on a cover after SECONDS "
+                                "(default: 60, 0: no limit)")
+    argparser.add_argument("--cover-memory", type=int, default=1024,
+                           metavar="MiB",
+                           help="give up on a cover needing more than MiB "
+                                "of memory (default: 1024, 0: no limit)")
+    argparser.add_argument("--near-duplicates", action="store_true",
+                           help="report the scores whose covers look alike "
+                                "(needs NumPy)")
+    argparser.add_argument("--templates", type=Path, metavar="DIR",
+                           help="directory of templates (score.html, "
+                                "archive.html, record.html, index.html) "
+                                "overriding the default ones")
+    argparser.add_argument("--page-size", type=int, default=0, metavar="N",
+                           help="split the scores into pages of N scores, "
+                                "with partituras.html as their index")
+    argparser.add_argument("--by-composer", action="store_true",
+                           help="split the scores into pages by composer, "
+                                "with partituras.html as their index")
+    argparser.add_argument("--no-search", action="store_true",
+                           help="do not write the search index")
+    argparser.add_argument("--search-prefix", type=int, default=2,
+                           metavar="N",
+                           help="shard the search index by the first N "
+                                "characters of the tokens (default: 2)")
+    argparser.add_argument("--async", dest="concurrency", type=int,
+                           default=0, metavar="N",
+                           help="build with the asyncio pipeline, "
+                                "rendering up to N covers at a time "
+                                "(ignores --covers)")
+    argparser.add_argument("--catalog", action="store_true",
+                           help=f"keep the scores in {CATALOG} and write "
+                                f"the page from it")
+    argparser.add_argument("--covers", choices=["now", "background", "skip"],
+                           default="now",
+                           help="render the missing covers before writing "
+                                "the page (default), while writing it, or "
+                                "not at all")
+    argparser.add_argument("--timings", action="store_true",
+                           help=f"time each stage, name and cover, print a "
+                                f"summary and write it to {TIMINGS_REPORT}")
+    argparser.add_argument("--profile", type=Path, metavar="FILE",
+                           help="profile the build with cProfile and write "
+                                "the statistics to FILE (for pstats)")
+    args = argparser.parse_args()
+    if args.cover_format == ".jpg" and args.cover_colors:
+        argparser.error("--cover-colors needs --cover-format .png or .webp")
+    if args.near_duplicates and duplicates.numpy is None:
+        argparser.error("--near-duplicates needs NumPy")
+    return args
+
+def build_options(args: argparse.Namespace, coversettings: CoverSettings,
+                  environment: Environment) -> str:
+    """Return a hash of the options of the build that change its output:
+    the covers, the pages, the search index, the templates and the
+    catalog."""
+    options = [coversettings.key, args.cover_format, args.page_size,
+               args.by_composer, args.no_search, args.search_prefix,
+               args.catalog, args.near_duplicates,
+               *(template_version(environment, name) for name in TEMPLATES)]
+    return hashlib.sha256(repr(options).encode()).hexdigest()[:16]
+
+def write_output(scorearchive: ScoreArchive, args: argparse.Namespace,
+                 catalog: Catalog | None = None,
+                 fragment_cache: FragmentCache | None = None,
+                 timings: Timings | None = None) -> None:
+    """Write the page, or pages, of the ScoreArchive and its search
+    index, with the records unchanged taken from fragment_cache, timing
+    each in timings, if given.
 
+    With a catalog, the records of the ScoreArchive, those changed, are
+    upserted into it, and the pages and the search index are built from
+    all of its records: a single page is rendered from its cursor."""
+    timings = timings or Timings()
+    if catalog is not None:
+        with timings.measure("catalog"):
+            catalog.upsert(scorearchive)
+            if args.page_size or args.by_composer:
+                scorearchive = ScoreArchive(catalog.select())
+    search = "" if args.no_search else (SEARCH_DIR / SEARCH_INDEX).as_posix()
+    with timings.measure("html"):
+        if args.page_size or args.by_composer:
+            scorearchive.write_pages(OUTPUT, args.page_size,
+                                     args.by_composer,
+                                     templates_dir=args.templates,
+                                     jobs=args.jobs, search=search,
+                                     fragment_cache=fragment_cache)
+            pages = [(p.path(OUTPUT).name, p.scorearchive)
+                     for p in scorearchive.shard(args.page_size,
+                                                 args.by_composer)]
+        else:
+            environment = html_environment(args.templates,
+                                           TEMPLATES_CACHE_DIR)
+            (catalog or scorearchive).write_html(
+                OUTPUT, environment, search=search,
+                fragment_cache=fragment_cache)
+            pages = [(OUTPUT.name, scorearchive if catalog is None
+                      else catalog.select())]
+            remove_shards(OUTPUT)
+    if search:
+        with timings.measure("search"):
+            SearchIndex.from_pages(pages).write(SEARCH_DIR,
+                                                args.search_prefix)
+
+def write_failures(failures: dict[str, str]) -> None:
+    """Report the covers that could not be rendered, if any."""
+    if not failures:
+        FAILURES_REPORT.unlink(missing_ok=True)
+        return
+    dump_json(FAILURES_REPORT, failures)
+    print(f"{len(failures)} covers failed, see {FAILURES_REPORT}",
+          file=sys.stderr)
+
+def write_parse_failures(parse_failures: list[ParseFailure]) -> None:
+    """Report the scores whose name could not be parsed, if any."""
+    if not parse_failures:
+        PARSE_FAILURES_REPORT.unlink(missing_ok=True)
+        return
+    dump_json(PARSE_FAILURES_REPORT, [f.to_dict() for f in parse_failures])
+    print(f"{len(parse_failures)} names could not be parsed, see "
+          f"{PARSE_FAILURES_REPORT}", file=sys.stderr)
+    for failure in parse_failures[:10]:
+        print(f"  {failure}", file=sys.stderr)
+
+def write_duplicates(identical: list[list[Score]],
+                     similar: list[tuple[Score, Score, int]]) -> None:
+    """Report the identical scores and the similar ones, if any."""
+    if not identical and not similar:
+        DUPLICATES_REPORT.unlink(missing_ok=True)
+        return
+    dump_json(DUPLICATES_REPORT, {
+        "identical": [[str(s.path) for s in group] for group in identical],
+        "similar": [[str(a.path), str(b.path), distance]
+                    for a, b, distance in similar],
+    })
+    print(f"{len(identical)} groups of identical scores and "
+          f"{len(similar)} pairs of similar ones, see {DUPLICATES_REPORT}",
+          file=sys.stderr)
+
+def write_timings(timings: Timings) -> None:
+    """Print the summary of the timings and write it to TIMINGS_REPORT."""
+    timings.report()
+    dump_json(TIMINGS_REPORT, timings.summary())
+    print(f"Timings written to {TIMINGS_REPORT}", file=sys.stderr)
+
+if __name__ == "__main__":
+    args = parse_args()
+    width, height = args.cover_size
+    coversettings = CoverSettings(
+        width, height,
+        colorspace="gray" if args.cover_gray else "rgb",
+        colors=args.cover_colors,
+        quality=args.cover_quality)
+    environment = html_environment(args.templates, TEMPLATES_CACHE_DIR)
+    options = build_options(args, coversettings, environment)
+    manifest = BuildManifest.load(BUILD_MANIFEST, manifest_version())
+    # timings and profiles are of a build, so they always build
+    if (not (args.force or args.timings or args.profile) and OUTPUT.exists()
+            and manifest.is_current(scan_fingerprints(args.score_dir),
+                                    options)):
+        sys.exit()
+    rebuild = manifest.options != options
+    manifest.use_options(options)
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    timings = Timings()
+    # names and covers are timed one by one only if asked
+    file_timings = timings if args.timings else None
+    start = time.perf_counter()
+    with timings.measure("load"):
+        covercache = CoverCache.load(COVERS_INDEX)
+        parse_cache = ParseCache.load(PARSE_CACHE, parser_version())
+        fragment_cache = FragmentCache.load(
+            FRAGMENT_CACHE, template_version(environment, "record.html"))
+    renderlimits = RenderLimits(args.cover_timeout or None,
+                                args.cover_memory * 2**20 or None)
+    failures = {}
+    parse_failures = []
+    identical = []
+    catalog = Catalog.open(CATALOG) if args.catalog else None
+    if args.concurrency:
+        # covers are rendered as the scores are discovered and parsed
+        with timings.measure("pipeline"):
+            scorearchive = asyncio.run(build_archive(
+                args.score_dir, manifest, covercache, coversettings,
+                parse_cache=parse_cache, parse_failures=parse_failures,
+                concurrency=args.concurrency, jobs=args.jobs,
+                limits=renderlimits, failures=failures,
+                identical=identical, timings=file_timings,
+                with_cover=False, cover_format=args.cover_format))
+        scores = [sr.score for sr in scorearchive]
+        manifest.prune(s.path for s in scores)
+        if catalog is not None:
+            catalog.prune(s.path for s in scores)
+            if not rebuild:
+                changed = {s.path for s in catalog.changed(scores)}
+                scorearchive = ScoreArchive(
+                    sr for sr in scorearchive if sr.score.path in changed)
+        write_output(scorearchive, args, catalog, fragment_cache, timings)
+    else:
+        with timings.measure("discover"):
+            scores = list(discover_scores(args.score_dir, with_cover=False,
+                                          cover_format=args.cover_format))
+        manifest.prune(s.path for s in scores)
+        if catalog is not None:
+            catalog.prune(s.path for s in scores)
+        with timings.measure("duplicates"):
+            identical = duplicates.find_duplicates(scores)
+            duplicates.share_covers(identical)
+        # with a catalog, only the scores changed since they were recorded
+        # are parsed and get their covers, the rest are read from it
+        changed = scores
+        if catalog is not None and not rebuild:
+            changed = catalog.changed(scores)
+        # names are parsed before any cover is rendered: the scores whose
+        # name cannot be parsed are left out of the covers too
+        with timings.measure("names"):
+            scorearchive = ScoreArchive.from_scores(
+                changed, manifest, parse_cache, parse_failures,
+                file_timings).sort()
+        # covers are rendered in page order, so the first page is ready
+        coverbatch = CoverBatch.from_scores((sr.score for sr in scorearchive),
+                                            covercache, coversettings,
+                                            limits=renderlimits,
+                                            timings=file_timings,
+                                            duplicates=identical)
+        failures = coverbatch.failures
+        if args.covers == "now":
+            with timings.measure("covers"):
+                coverbatch.run(args.jobs)
+        elif args.covers == "background":
+            coverbatch.start(args.jobs)
+        write_output(scorearchive, args, catalog, fragment_cache, timings)
+        if args.covers == "background":
+            with timings.measure("covers"):
+                rendered = coverbatch.wait()
+            if rendered:
+                # again, with the new placeholders
+                write_output(scorearchive, args, catalog, fragment_cache,
+                             timings)
+        elif args.covers == "skip":
+            manifest.forget(s.path for s in coverbatch.pending)
+            if catalog is not None:
+                catalog.forget(s.path for s in coverbatch.pending)
+    write_parse_failures(parse_failures)
+    write_failures(failures)
+    # so the next build retries them, even if no score changed
+    manifest.forget(Path(p) for p in failures)
+    if catalog is not None:
+        catalog.forget(Path(p) for p in failures)
+    similar = []
+    if args.near_duplicates:
+        with timings.measure("near-duplicates"):
+            # the placeholders of the scores unchanged are in the catalog
+            similar = duplicates.find_near_duplicates(
+                scores if catalog is None
+                else (sr.score for sr in catalog.select()))
+    write_duplicates(identical, similar)
+    with timings.measure("save"):
+        covercache.collect_garbage(s.cover for s in scores)
+        covercache.save()
+        manifest.save()
+        parse_cache.save()
+        fragment_cache.save()
+    if fragment_cache.hits + fragment_cache.misses:
+        print(f"HTML fragments: {fragment_cache.hits} cached, "
+              f"{fragment_cache.misses} rendered "
+              f"({fragment_cache.hit_rate():.0%} hit rate)")
+    if catalog is not None:
+        catalog.close()
+    timings.add("build", time.perf_counter() - start)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}", file=sys.stderr)
+    if args.timings:
+        write_timings(timings)
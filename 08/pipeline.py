@@ -0,0 +1,150 @@
+import asyncio
+from concurrent.futures import Executor
+from pathlib import Path
+
+from cache import BuildManifest, CoverCache, ParseCache
+from duplicates import find_duplicates, share_covers
+from score import (CoverBatch, CoverSettings, ParseFailure, RenderLimits,
+                   Score, ScoreArchive, ScoreRecord, discover_scores)
+from timings import Timings
+
+BATCH_SIZE = 256
+QUEUE_SIZE = 1024
+
+async def discover(score_dir: Path, out: asyncio.Queue,
+                   identical: list[list[Score]], **kwargs) -> None:
+    """Put batches of the scores in score_dir into out, walking the
+    directory and finding the identical pdfs in a thread.
+
+    The groups of identical scores, sharing a cover, are added to
+    identical, and each one is put whole into a batch, right after its
+    first score."""
+    scores = await asyncio.to_thread(list, discover_scores(score_dir,
+                                                           **kwargs))
+    groups = await asyncio.to_thread(find_duplicates, scores)
+    share_covers(groups)
+    identical.extend(groups)
+    firsts = {id(group[0]): group for group in groups}
+    copies = {id(s) for group in groups for s in group[1:]}
+    batch = []
+    for s in scores:
+        if id(s) not in copies:
+            batch.extend(firsts.get(id(s), [s]))
+        if len(batch) >= BATCH_SIZE:
+            await out.put(batch)
+            batch = []
+    if batch:
+        await out.put(batch)
+    await out.put(None)
+
+async def parse(inp: asyncio.Queue, out: asyncio.Queue,
+                manifest: BuildManifest | None,
+                parse_cache: ParseCache | None,
+                parse_failures: list[ParseFailure], workers: int,
+                timings: Timings | None = None) -> None:
+    """Put the ScoreRecord of the batches of scores from inp into out,
+    those sharing a cover in a list together. The names that cannot be
+    parsed are recorded in parse_failures."""
+    while (batch := await inp.get()) is not None:
+        scorearchive = await asyncio.to_thread(
+            ScoreArchive.from_scores, batch, manifest, parse_cache,
+            parse_failures, timings)
+        by_cover = {}
+        for scorerecord in scorearchive:
+            by_cover.setdefault(scorerecord.score.cover, []).append(
+                scorerecord)
+        for scorerecords in by_cover.values():
+            await out.put(scorerecords)
+    for _ in range(workers):
+        await out.put(None)
+
+async def cover(inp: asyncio.Queue, out: asyncio.Queue,
+                pool: Executor, cache: CoverCache | None,
+                settings: CoverSettings, limits: RenderLimits,
+                failures: dict[str, str], identical: list[list[Score]],
+                timings: Timings | None = None) -> None:
+    """Render the pending covers of the lists of ScoreRecord from inp in
+    pool, within limits, sharing those of the groups of identical
+    scores, and put each ScoreRecord into out. The covers that fail are
+    recorded in failures."""
+    loop = asyncio.get_running_loop()
+    shared = None
+    while (scorerecords := await inp.get()) is not None:
+        # identical is complete once discovery puts the first batch
+        if shared is None:
+            shared = {group[0].cover: group for group in identical}
+        scores = [sr.score for sr in scorerecords]
+        group = shared.get(scores[0].cover)
+        coverbatch = await asyncio.to_thread(
+            CoverBatch.from_scores, scores, cache, settings,
+            limits=limits, timings=timings,
+            duplicates=[group] if group else [])
+        # creating cover directories and hashing pdfs for the cache
+        # block on slow disks, so they are done in threads too
+        generators = await asyncio.to_thread(coverbatch.generators)
+        for s, generator in zip(coverbatch.pending, generators):
+            try:
+                result = await loop.run_in_executor(
+                    pool, coverbatch.task(generator, pool))
+                await asyncio.to_thread(coverbatch.complete, s, result)
+            except Exception as error:
+                coverbatch.fail(s, error)
+        failures.update(coverbatch.failures)
+        for scorerecord in scorerecords:
+            await out.put(scorerecord)
+    await out.put(None)
+
+async def collect(inp: asyncio.Queue, workers: int) -> list[ScoreRecord]:
+    """Return the ScoreRecord from inp until every worker has finished."""
+    scorerecords = []
+    while workers:
+        scorerecord = await inp.get()
+        if scorerecord is None:
+            workers -= 1
+        else:
+            scorerecords.append(scorerecord)
+    return scorerecords
+
+async def build_archive(score_dir: Path,
+                        manifest: BuildManifest | None = None,
+                        cache: CoverCache | None = None,
+                        settings: CoverSettings = CoverSettings(),
+                        parse_cache: ParseCache | None = None,
+                        concurrency: int = 4, jobs: int = 0,
+                        queue_size: int = QUEUE_SIZE,
+                        limits: RenderLimits = RenderLimits(),
+                        failures: dict[str, str] | None = None,
+                        parse_failures: list[ParseFailure] | None = None,
+                        identical: list[list[Score]] | None = None,
+                        timings: Timings | None = None,
+                        **kwargs) -> ScoreArchive:
+    """Construct the sorted ScoreArchive of the scores in score_dir, with
+    their covers.
+
+    Discovery, parsing and cover rendering run as concurrent stages
+    connected by queues of at most queue_size items, so a slow stage
+    holds back the previous ones. Discovery finds the groups of
+    identical pdfs, and adds them to identical, before any score is
+    parsed, so the cover they share is rendered once. Up to concurrency covers are rendered
+    at a time, in a pool of jobs processes (one per CPU if jobs == 0),
+    within limits; the covers that fail get the blank cover and are
+    recorded in failures. The scores whose name cannot be parsed are
+    left out, before their cover is rendered, and recorded in
+    parse_failures. Each name parsed and cover rendered is timed in
+    timings, if given. The scores are constructed with kwargs."""
+    failures = {} if failures is None else failures
+    parse_failures = [] if parse_failures is None else parse_failures
+    identical = [] if identical is None else identical
+    scores = asyncio.Queue(max(1, queue_size // BATCH_SIZE))
+    parsed = asyncio.Queue(queue_size)
+    covered = asyncio.Queue(queue_size)
+    with limits.executor(jobs) as pool:
+        *_, scorerecords = await asyncio.gather(
+            discover(score_dir, scores, identical, **kwargs),
+            parse(scores, parsed, manifest, parse_cache, parse_failures,
+                  concurrency, timings),
+            *(cover(parsed, covered, pool, cache, settings, limits,
+                    failures, identical, timings)
+              for _ in range(concurrency)),
+            collect(covered, concurrency))
+    return ScoreArchive(scorerecords).sort()
@@ -1,17 +1,55 @@
+import base64
+import bisect
+import hashlib
+import inspect
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import time
+import unicodedata
 from collections import UserList
-from dataclasses import dataclass, field, KW_ONLY
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import (Executor, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from dataclasses import asdict, astuple, dataclass, field, KW_ONLY
+from functools import cache, partial
 from itertools import zip_longest
 from pathlib import Path
-from typing_extensions import ClassVar, Self # in >3.10: from typing ...
+from typing_extensions import Any, ClassVar, Self # in >3.10: from typing ...
 
 from lark import Lark, Token, Transformer
-from jinja2 import Template
-from pymupdf import Document as PdfDocument
+from lark.exceptions import LarkError
+from jinja2 import (ChoiceLoader, DictLoader, Environment,
+                    FileSystemBytecodeCache, FileSystemLoader)
+from pymupdf import (TOOLS, Document as PdfDocument, Matrix, Pixmap, Rect,
+                     csGRAY, csRGB)
+
+try:
+    import resource
+except ImportError:     # not on Windows: no memory limit
+    resource = None
+
+from cache import (BuildManifest, CoverCache, FragmentCache, ParseCache,
+                   atomic_open)
+from discovery import SCORE_SUFFIXES, walk_files
+from timings import Timings
 
 COVERS_DIR = Path("img")
 COVER_FORMAT = ".png"
+# hidden files are not discovered, so no score has this cover
+BLANK_COVER = Path(COVERS_DIR, ".blank-score.jpg")
+PLACEHOLDER_SHRINK = 5
+COVERS_INDEX = Path("covers.json")
+BUILD_MANIFEST = Path("manifest.json")
+PARSE_CACHE = Path("names.json")
+TEMPLATES_CACHE_DIR = Path("templates-cache")
+FRAGMENT_CACHE = Path(TEMPLATES_CACHE_DIR, "fragments.json")
+HTML_BUFFER_SIZE = 64
 
-# Grammar for score filenames
+# Grammar for score filenames. With the LALR parser, whitespace at the
+# start of a word is ignored, and a word cannot start with "-" or "+"
 GRAMMAR = """
     score: composer "_" work ("_" editor)?
     
@@ -49,115 +87,1082 @@ ARCHIVE_HTML_TEMPLATE = """
       <title>Web Partituras</title>
       <meta charset="utf-8">
       <link href="css/score.css" rel="stylesheet">
+      {%- if search %}
+      <script src="js/search.js" defer></script>
+      {%- endif %}
     </head>
     <body>
       <h1>Web Partituras</h1>
+      {%- if navigation %}
+      <nav class="score-pages">
+        <a href="{{navigation.index}}">Índice</a>
+        {%- if navigation.previous %}
+        <a href="{{navigation.previous}}">Anterior</a>
+        {%- endif %}
+        <span>{{navigation.title}}</span>
+        {%- if navigation.next %}
+        <a href="{{navigation.next}}">Siguiente</a>
+        {%- endif %}
+      </nav>
+      {%- endif %}
+      {%- if search %}
+      <div class="score-search">
+        <input type="search" placeholder="Buscar" data-index="{{search}}">
+        <p class="score-search-results"></p>
+      </div>
+      {%- endif %}
       <section class="score-archive">
       {% for scorerecord in scorearchive %}
-        <article class="score-record">
+        <article class="score-record"
+          {%- if search %} id="score-{{offset + loop.index0}}"{% endif %}>
+          {{- render_record(scorerecord) }}
+        </article>
+      {% endfor %}
+      </section>
+    </body>
+    </html>
+    """
+
+# The content of a record of the archive, rendered on its own so it can
+# be cached: it does not depend on the position of the record
+RECORD_HTML_TEMPLATE = """
           <div class="score-link"
-               style="background-image: url({{scorerecord.score.cover}})">
-            <a download href="{{scorerecord.score.path}}"></a>
+               {%- if scorerecord.score.placeholder %}
+               style="background-image: url({{scorerecord.score.placeholder}})"
+               {%- endif %}>
+            <a download href="{{scorerecord.score.path}}">
+              <img src="{{scorerecord.score.cover}}" alt="" loading="lazy"
+                   decoding="async">
+            </a>
           </div>
           <div class="score-info">
             <p class="composer">{{scorerecord.composer}}</p>
             <p class="work">{{scorerecord.work}}</p>
             <p class="editor">{{scorerecord.editor}}</p>
-          </div>
-        </article>
+            {%- if scorerecord.pdfinfo %}
+            <p class="pages">{{scorerecord.pdfinfo.pages}} págs.</p>
+            {%- endif %}
+          </div>"""
+
+INDEX_HTML_TEMPLATE = """
+    <!DOCTYPE html>
+    <html lang="es">
+    <head>
+      <title>Web Partituras</title>
+      <meta charset="utf-8">
+      <link href="css/score.css" rel="stylesheet">
+    </head>
+    <body>
+      <h1>Web Partituras</h1>
+      <nav class="score-index">
+      {% for page in pages %}
+        <p><a href="{{page.href}}">{{page.title}}</a> ({{page.count}})</p>
       {% endfor %}
-      </section>
+      </nav>
     </body>
     </html>
     """
 
-@dataclass
+class ScoreNameTransformer(Transformer):
+    FIELDS: ClassVar[list[str]] = ["composer", "work", "editor"]
+
+    def score(self, items: list[str]) -> dict:
+        return dict(zip_longest(self.FIELDS, items, fillvalue=""))
+
+    def words(self, items: list[str]) -> str:
+        return " ".join(items)
+
+    def word(self, items: list[Token]) -> str:
+        return "-".join(items)
+
+    composer = words
+    work = words
+    editor = words
+
+@cache
+def score_name_parser() -> Lark:
+    """Return the parser of score names.
+
+    The grammar is compiled only once per process (LALR, with the
+    analysis cached on disk by Lark) and the ScoreNameTransformer is
+    applied while parsing, so no intermediate tree is built."""
+    return Lark(GRAMMAR, start="score", parser="lalr",
+                transformer=ScoreNameTransformer(), cache=True)
+
+# Fast path for the usual score names: those without whitespace, which
+# the grammar ignores around the tokens
+FAST_SUBWORD = r"[^-+_ \t\f\r\n]+"
+FAST_WORDS = rf"{FAST_SUBWORD}(?:[-+]{FAST_SUBWORD})*"
+FAST_SCORE_NAME = re.compile(rf"({FAST_WORDS})_({FAST_WORDS})"
+                             rf"(?:_({FAST_WORDS}))?")
+
+def parse_score_name_fast(name: str) -> dict | None:
+    """Parse the given score name like the grammar and the
+    ScoreNameTransformer, without them, or return None if the name is
+    not a usual one."""
+    match = FAST_SCORE_NAME.fullmatch(name)
+    if match is None:
+        return None
+    return {field: (words or "").replace("-", " ").replace("+", "-")
+            for field, words in zip(ScoreNameTransformer.FIELDS,
+                                    match.groups())}
+
+def parse_score_name(name: str) -> dict:
+    """Parse the given score name into a dictionary of its fields, with
+    the fast path if possible and the grammar otherwise."""
+    return parse_score_name_fast(name) or score_name_parser().parse(name)
+
+@cache
+def parser_version() -> str:
+    """Return a hash of the grammar and the code applying it, which
+    identifies the fields parsed from a name across builds."""
+    digest = hashlib.sha256(GRAMMAR.encode())
+    for code in (ScoreNameTransformer, parse_score_name_fast):
+        digest.update(inspect.getsource(code).encode())
+    digest.update(FAST_SCORE_NAME.pattern.encode())
+    return digest.hexdigest()[:16]
+
+TEMPLATES = {
+    "score.html": SCORE_HTML_TEMPLATE,
+    "archive.html": ARCHIVE_HTML_TEMPLATE,
+    "record.html": RECORD_HTML_TEMPLATE,
+    "index.html": INDEX_HTML_TEMPLATE,
+}
+
+@cache
+def html_environment(templates_dir: Path | None = None,
+                     bytecode_cache_dir: Path | None = None) -> Environment:
+    """Return the environment of the HTML templates.
+
+    Templates are compiled once per environment. Those in templates_dir,
+    if given, override the TEMPLATES of the same name, and the compiled
+    templates are kept across runs in bytecode_cache_dir, if given."""
+    loader = DictLoader(TEMPLATES)
+    if templates_dir is not None:
+        loader = ChoiceLoader([FileSystemLoader(templates_dir), loader])
+    bytecode_cache = None
+    if bytecode_cache_dir is not None:
+        bytecode_cache_dir.mkdir(parents=True, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+    environment = Environment(loader=loader, bytecode_cache=bytecode_cache)
+    environment.globals["render_record"] = partial(render_record, environment)
+    return environment
+
+def render_record(environment: Environment, scorerecord: "ScoreRecord",
+                  fragment_cache: FragmentCache | None = None) -> str:
+    """Render the content of the ScoreRecord in the archive, taking it
+    from fragment_cache, if given and there."""
+    if fragment_cache is None:
+        template = environment.get_template("record.html")
+        return template.render(scorerecord=scorerecord)
+    key = scorerecord.fragment_key()
+    fragment = fragment_cache.get(key)
+    if fragment is None:
+        template = environment.get_template("record.html")
+        fragment = template.render(scorerecord=scorerecord)
+        fragment_cache.put(key, fragment)
+    return fragment
+
+def record_context(environment: Environment,
+                   fragment_cache: FragmentCache | None = None) -> dict:
+    """Return the context rendering the records of the archive from
+    fragment_cache, if given."""
+    if fragment_cache is None:
+        return {}
+    return {"render_record": partial(render_record, environment,
+                                     fragment_cache=fragment_cache)}
+
+def template_version(environment: Environment, template_name: str) -> str:
+    """Return a hash of the source of the template."""
+    source, _, _ = environment.loader.get_source(environment, template_name)
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+def render_to_file(path: Path, template_name: str,
+                   templates_dir: Path | None = None,
+                   fragment_cache: FragmentCache | None = None,
+                   **context) -> bool:
+    """Render the template to path, unless path already has that content,
+    and return whether path was written. The records of archive pages
+    are taken from fragment_cache, if given."""
+    environment = html_environment(templates_dir, TEMPLATES_CACHE_DIR)
+    context |= record_context(environment, fragment_cache)
+    html_page = environment.get_template(template_name).render(**context)
+    content = html_page.encode("utf-8")
+    if path.exists() and path.read_bytes() == content:
+        return False
+    with atomic_open(path, "wb") as f:
+        f.write(content)
+    return True
+
+def slugify(s: str) -> str:
+    """Convert s into an ASCII, lowercase, dash-separated name."""
+    s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode()
+    return "-".join(re.findall(r"[a-z0-9]+", s.lower()))
+
+def collate(s: str) -> str:
+    """Return the Spanish collation key of s: case and accents are
+    ignored, but ñ sorts as a letter between n and o, whether it is
+    composed or not (as in macOS filenames)."""
+    s = unicodedata.normalize("NFC", s).lower().replace("ñ", "n\x7f")
+    s = unicodedata.normalize("NFKD", s)
+    return "".join(c for c in s if not unicodedata.combining(c))
+
+@cache
+def collate_composer(composer: str) -> tuple[str, str]:
+    """Return the collation keys of the surname and the first names of the
+    composer."""
+    composer_names = composer.split(" ")
+    composer_last_name = composer_names[-1]
+    composer_first_name = " ".join(composer_names[:-1])
+    return collate(composer_last_name), collate(composer_first_name)
+
+def collation_key(composer: str, work: str,
+                  editor: str = "") -> tuple[str, ...]:
+    """Return the key to sort scores by composer surname, first names and
+    work, and then by their exact spelling, and editions of a work by
+    editor."""
+    return (*collate_composer(composer), collate(work), composer, work,
+            collate(editor), editor)
+
+def sort_key(scorerecord: "ScoreRecord") -> tuple:
+    """Return the key to sort the ScoreRecord: its collation key, and then
+    its pdf path, so the order does not depend on discovery."""
+    return scorerecord.collation_key, str(scorerecord.score.path)
+
+@cache
+def manifest_version() -> str:
+    """Return a hash of the parser version and the collation code, which
+    identifies the fields and collation keys recorded in the manifest."""
+    digest = hashlib.sha256(parser_version().encode())
+    for code in (collate, collate_composer, collation_key):
+        digest.update(inspect.getsource(code).encode())
+    return digest.hexdigest()[:16]
+
+@dataclass(slots=True)
+class PdfInfo:
+    pages: int = 0
+    size: int = 0
+    title: str = ""
+    author: str = ""
+    width: float = 0.0
+    height: float = 0.0
+
+    @classmethod
+    def from_document(cls, document: PdfDocument, pdf: Path) -> Self:
+        """Construct the PdfInfo of the open document of pdf."""
+        metadata = document.metadata or {}
+        page = document[0]
+        return cls(pages=document.page_count,
+                   size=pdf.stat().st_size,
+                   title=metadata.get("title") or "",
+                   author=metadata.get("author") or "",
+                   width=page.rect.width,
+                   height=page.rect.height)
+
+@dataclass(slots=True)
 class Score:
     path: Path
-    name: str = field(init=False)
-    cover: Path = field(init=False)
+    placeholder: str = field(default="", init=False)
+    pdfinfo: PdfInfo | None = field(default=None, init=False)
+    _cover: Path | None = field(default=None, init=False, repr=False)
     _: KW_ONLY
-    with_cover: bool = True
+    with_cover: bool = False
+    cover_format: str = COVER_FORMAT
 
     def __post_init__(self):
-        self.name = self.path.stem
-        self.cover = Path(COVERS_DIR, self.name).with_suffix(COVER_FORMAT)
+        self.cover_format = sys.intern(self.cover_format)
         if self.with_cover:
             CoverGenerator(self.path, self.cover).make_cover() 
 
-    def to_dict(self) -> dict:
-        """Convert the Score name into a dictionary."""
-        parser = Lark(GRAMMAR, start="score")
-        tree = parser.parse(self.name)
-        scoreinfo = ScoreNameTransformer().transform(tree)
+    @property
+    def name(self) -> str:
+        """Name of the score: its filename without suffix."""
+        return self.path.stem
+
+    @property
+    def cover(self) -> Path:
+        """Path of the cover of the score, computed on demand (to keep
+        scores small) unless set."""
+        if self._cover is not None:
+            return self._cover
+        return Path(COVERS_DIR, self.name).with_suffix(self.cover_format)
+
+    @cover.setter
+    def cover(self, cover: Path) -> None:
+        self._cover = cover
+
+    def to_dict(self, parse_cache: ParseCache | None = None) -> dict:
+        """Convert the Score name into a dictionary, memoizing in
+        parse_cache, if given, the fields of the names parsed by the
+        grammar: the fast path is quicker than a lookup."""
+        scoreinfo = parse_score_name_fast(self.name)
+        if scoreinfo is None and parse_cache is not None:
+            scoreinfo = parse_cache.get(self.name)
+        if scoreinfo is None:
+            scoreinfo = score_name_parser().parse(self.name)
+            if parse_cache is not None:
+                parse_cache.put(self.name, scoreinfo)
         return scoreinfo | {"score": self}
 
-@dataclass
+def discover_scores(directory: Path,
+                    suffixes: tuple[str, ...] = SCORE_SUFFIXES,
+                    **kwargs) -> Iterator[Score]:
+    """Yield a Score, constructed with kwargs, for each score file in
+    directory and its subdirectories, as they are found.
+
+    The covers of the scores in subdirectories mirror them in
+    COVERS_DIR, so scores of the same name in different subdirectories
+    get different covers."""
+    with_cover = kwargs.pop("with_cover", False)
+    root = os.fspath(directory)
+    parent = covers_dir = None
+    for entry in walk_files(directory, suffixes):
+        s = Score(Path(entry.path), **kwargs)
+        if os.path.dirname(entry.path) != parent:
+            parent = os.path.dirname(entry.path)
+            subdirectory = os.path.relpath(parent, root)
+            covers_dir = (None if subdirectory == os.curdir
+                          else Path(COVERS_DIR, subdirectory))
+        if covers_dir is not None:
+            s.cover = covers_dir / s.cover.name
+        if with_cover:
+            s.cover.parent.mkdir(parents=True, exist_ok=True)
+            CoverGenerator(s.path, s.cover).make_cover()
+        yield s
+
+@dataclass(slots=True)
+class ParseFailure:
+    """A score whose name does not follow the grammar: the position in
+    the name where it goes wrong, counting from 1, and what the grammar
+    expected there."""
+    EXPECTED: ClassVar[dict[str, str]] = {
+        "UNDERSCORE": "_", "MINUS": "-", "PLUS": "+",
+        "SUBWORD": "a word", "$END": "the end of the name"}
+
+    path: Path
+    position: int
+    expected: list[str]
+
+    @classmethod
+    def from_error(cls, path: Path, error: LarkError) -> Self:
+        """Construct the ParseFailure of the name of path from the error
+        raised by its parser."""
+        token = getattr(error, "token", None)
+        position = getattr(error, "column", len(path.stem) + 1)
+        if token is not None and token.type == "$END":
+            position = len(path.stem) + 1
+        expected = (getattr(error, "expected", None)
+                    or getattr(error, "allowed", None) or ())
+        return cls(path, position,
+                   sorted(cls.EXPECTED.get(e, e) for e in expected))
+
+    def __str__(self) -> str:
+        return (f"{self.path.stem}: at {self.position}, expected "
+                f"{' or '.join(self.expected)}")
+
+    def to_dict(self) -> dict:
+        """Convert the ParseFailure into a dictionary, for reports."""
+        return {"pdf": str(self.path), "name": self.path.stem,
+                "position": self.position, "expected": self.expected}
+
+@dataclass(slots=True)
 class ScoreRecord:
     composer: str
     work: str
     editor: str
     score: Score 
+    collation_key: tuple = field(default=(), compare=False, repr=False)
+
+    def __post_init__(self):
+        self.composer = sys.intern(self.composer)
+        self.editor = sys.intern(self.editor)
+        self.collation_key = (tuple(self.collation_key)
+                              or collation_key(self.composer, self.work,
+                                               self.editor))
 
     @classmethod
     def from_dict(cls, d: dict) -> Self:
         """Construct a ScoreRecord from the given dictionary."""
         return cls(**d) 
+
+    @property
+    def pdfinfo(self) -> PdfInfo | None:
+        """PdfInfo of the score, if known."""
+        return self.score.pdfinfo
+
+    def to_dict(self) -> dict:
+        """Convert the ScoreRecord, but its score, into a dictionary."""
+        return {
+            "composer": self.composer,
+            "work": self.work,
+            "editor": self.editor,
+            "collation_key": list(self.collation_key),
+        }
  
     @classmethod
-    def from_score(cls, s: Score) -> Self:
-        """Construct a ScoreRecord from the given score."""
-        return cls.from_dict(s.to_dict())
+    def from_score(cls, s: Score,
+                   parse_cache: ParseCache | None = None) -> Self:
+        """Construct a ScoreRecord from the given score, with the fields
+        memoized in parse_cache, if given."""
+        return cls.from_dict(s.to_dict(parse_cache))
     
-    def to_html(self) -> str:
+    def fragment_key(self) -> str:
+        """Return a hash of what the record shows in the archive, to key
+        its HTML fragment."""
+        s = self.score
+        shown = repr((self.composer, self.work, self.editor, str(s.path),
+                      str(s.cover), s.placeholder,
+                      s.pdfinfo and astuple(s.pdfinfo)))
+        return hashlib.blake2b(shown.encode(), digest_size=16).hexdigest()
+
+    def to_html(self, environment: Environment | None = None) -> str:
         """Convert the ScoreRecord into an HTML element."""
-        return Template(SCORE_HTML_TEMPLATE).render(scorerecord=self)
+        environment = environment or html_environment()
+        template = environment.get_template("score.html")
+        return template.render(scorerecord=self)
 
-class ScoreNameTransformer(Transformer):
-    FIELDS: ClassVar[list[str]] = ["composer", "work", "editor"]
+class ScoreArchive(UserList):
+    @classmethod
+    def from_scores(cls, scores: Iterable[Score],
+                    manifest: BuildManifest | None = None,
+                    parse_cache: ParseCache | None = None,
+                    failures: list["ParseFailure"] | None = None,
+                    timings: Timings | None = None) -> Self:
+        """Construct the ScoreArchive from the given scores.
 
-    def score(self, items: list[str]) -> dict:
-        return dict(zip_longest(self.FIELDS, items, fillvalue=""))
+        With a manifest, the names and collation keys of the scores
+        unchanged since the last build are not computed again, and the
+        manifest is updated with the rest. With a parse_cache, the names
+        parsed in former builds are not parsed again.
 
-    def words(self, items: list[str]) -> str:
-        return " ".join(items)
+        A name that does not follow the grammar raises its Lark error,
+        unless failures is given: then the score is left out, a
+        ParseFailure is appended to failures and the rest of the scores
+        are parsed.
 
-    def word(self, items: list[Token]) -> str:
-        return "-".join(items)
+        With timings, the time spent on each name parsed is added to
+        them, labelled with the pdf path."""
+        scorerecords = []
+        for s in scores:
+            if manifest is not None:
+                scoreinfo = manifest.lookup(s.path)
+                if scoreinfo is not None:
+                    scorerecords.append(
+                        ScoreRecord.from_dict(scoreinfo | {"score": s}))
+                    continue
+            start = time.perf_counter()
+            try:
+                scorerecord = ScoreRecord.from_score(s, parse_cache)
+            except LarkError as error:
+                if failures is None:
+                    raise
+                failures.append(ParseFailure.from_error(s.path, error))
+                if manifest is not None:
+                    manifest.record(s.path, None)
+                continue
+            finally:
+                if timings is not None:
+                    timings.add("parse", time.perf_counter() - start,
+                                str(s.path))
+            if manifest is not None:
+                manifest.record(s.path, scorerecord.to_dict())
+            scorerecords.append(scorerecord)
+        return cls(scorerecords)
 
-    composer = words
-    work = words
-    editor = words
+    def sort(self, key: Callable[[ScoreRecord], Any] | None = None) -> Self:
+        """Sort the ScoreRecord by composer, work, editor and pdf path, or
+        by key if given (for instance, by the pages of their PdfInfo)."""
+        return ScoreArchive(sorted(self, key=key or sort_key))
 
-class ScoreArchive(UserList):
-    @classmethod
-    def from_scores(cls, scores: list[Score]) -> Self:
-        """Construct the ScoreArchive from the given scores."""
-        return cls([ScoreRecord.from_score(s) for s in scores])
-
-    def sort(self) -> Self:
-        """Sort the ScoreRecord by composer and work."""
-        def composer_and_work(sr: ScoreRecord) -> tuple:
-            composer_names = sr.composer.split(" ")
-            composer_last_name = composer_names[-1]
-            composer_first_name = composer_names[:-1]
-            return (composer_last_name, composer_first_name, sr.work)
-        return ScoreArchive(sorted(self, key=composer_and_work))
-
-    def to_html(self) -> str:
-        """Convert the ScoreArchive into an HTML element."""
-        return Template(ARCHIVE_HTML_TEMPLATE).render(scorearchive=self)
+    def insert_sorted(self, scorerecord: ScoreRecord) -> None:
+        """Insert the ScoreRecord into the sorted ScoreArchive, keeping it
+        sorted."""
+        bisect.insort(self.data, scorerecord, key=sort_key)
+
+    def to_html(self, environment: Environment | None = None,
+                search: str = "",
+                fragment_cache: FragmentCache | None = None) -> str:
+        """Convert the ScoreArchive into an HTML element.
+
+        If search is given, the page searches the search index in that
+        location. With a fragment_cache, the records unchanged since it
+        was filled are not rendered again."""
+        environment = environment or html_environment()
+        template = environment.get_template("archive.html")
+        return template.render(scorearchive=self, search=search, offset=0,
+                               **record_context(environment, fragment_cache))
+
+    def write_html(self, path: Path, environment: Environment | None = None,
+                   search: str = "",
+                   fragment_cache: FragmentCache | None = None) -> None:
+        """Write the ScoreArchive as an HTML page to path, like to_html.
+
+        The page is streamed to a temporary file, HTML_BUFFER_SIZE
+        template pieces at a time, which then replaces path."""
+        environment = environment or html_environment()
+        template = environment.get_template("archive.html")
+        stream = template.stream(scorearchive=self, search=search, offset=0,
+                                 **record_context(environment,
+                                                  fragment_cache))
+        stream.enable_buffering(HTML_BUFFER_SIZE)
+        with atomic_open(path, encoding="utf-8") as f:
+            stream.dump(f)
+
+    def paginate(self, size: int) -> list[Self]:
+        """Split the ScoreArchive into ScoreArchive of size records."""
+        return [ScoreArchive(self[i:i + size])
+                for i in range(0, len(self), size)] or [ScoreArchive()]
+
+    def by_composer(self) -> dict[str, Self]:
+        """Group the ScoreRecord by composer, keeping their order."""
+        groups = {}
+        for sr in self:
+            groups.setdefault(sr.composer, ScoreArchive()).append(sr)
+        return groups
+
+    def shard(self, page_size: int = 0,
+              by_composer: bool = False) -> list["ScorePage"]:
+        """Split the ScoreArchive into pages of at most page_size records
+        (if page_size is not 0), one or more per composer if by_composer.
+
+        Composers whose names slugify alike (such as Anónimo and Anonimo)
+        get numbered slugs, and those with no slug at all (such as
+        non-Latin names) are named by the position of their page."""
+        groups = self.by_composer() if by_composer else {"": self}
+        pages = []
+        slugs = set()
+        offset = 0
+        for composer, group in groups.items():
+            chunks = group.paginate(page_size) if page_size else [group]
+            for number, chunk in enumerate(chunks, 1):
+                slug = slugify(composer) or str(len(pages) + 1)
+                title = composer or f"Página {number}"
+                if not composer:
+                    slug = str(number)
+                elif len(chunks) > 1:
+                    slug = f"{slug}-{number}"
+                    title = f"{composer} ({number}/{len(chunks)})"
+                unique, copy = slug, 1
+                while unique in slugs:
+                    copy += 1
+                    unique = f"{slug}-{copy}"
+                slugs.add(unique)
+                pages.append(ScorePage(unique, title, chunk, offset))
+                offset += len(chunk)
+        return pages
+
+    def write_pages(self, path: Path, page_size: int = 0,
+                    by_composer: bool = False,
+                    templates_dir: Path | None = None,
+                    jobs: int = 1, search: str = "",
+                    fragment_cache: FragmentCache | None = None
+                    ) -> list[Path]:
+        """Write the ScoreArchive as an index page in path and its shards
+        as pages next to it, named after path, and return the pages
+        written.
+
+        Pages whose content has not changed are not written again, and
+        pages of former shards are deleted. With jobs > 1 (or jobs == 0,
+        meaning one per CPU) the pages are rendered in a pool of
+        processes; otherwise the records are taken from fragment_cache,
+        if given.
+
+        The records of the pages are numbered in page order, starting
+        at the offset of each page, for the search index."""
+        pages = self.shard(page_size, by_composer)
+        paths = [p.path(path) for p in pages]
+        index = [{"href": p.name, "title": page.title,
+                  "count": len(page.scorearchive)}
+                 for p, page in zip(paths, pages)]
+        renders = [(path, "index.html", {"pages": index})]
+        for i, page in enumerate(pages):
+            navigation = {
+                "index": path.name,
+                "previous": paths[i - 1].name if i > 0 else "",
+                "next": paths[i + 1].name if i + 1 < len(paths) else "",
+                "title": page.title,
+            }
+            renders.append((paths[i], "archive.html",
+                            {"scorearchive": page.scorearchive,
+                             "navigation": navigation,
+                             "search": search,
+                             "offset": page.offset}))
+        if jobs == 1:
+            written = [render_to_file(p, t, templates_dir, fragment_cache,
+                                      **context)
+                       for p, t, context in renders]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs or None) as pool:
+                futures = [pool.submit(render_to_file, p, t, templates_dir,
+                                       **context)
+                           for p, t, context in renders]
+                written = [f.result() for f in futures]
+        remove_shards(path, paths)
+        return [p for (p, _, _), w in zip(renders, written) if w]
+
+def remove_shards(path: Path, keep: Iterable[Path] = ()) -> None:
+    """Delete the pages of the former shards of the page in path, but
+    those in keep."""
+    keep = set(keep)
+    for former in path.parent.glob(f"{path.stem}-*{path.suffix}"):
+        if former not in keep:
+            former.unlink()
+
+@dataclass
+class ScorePage:
+    slug: str
+    title: str
+    scorearchive: ScoreArchive
+    offset: int = 0
+
+    def path(self, index: Path) -> Path:
+        """Return the path of the page next to the index page."""
+        return index.with_name(f"{index.stem}-{self.slug}{index.suffix}")
+
+@dataclass(frozen=True)
+class CoverSettings:
+    """Settings of the cover rendering.
+
+    The first page (or its clip, in PDF points) is scaled to fit in
+    width x height pixels, the size of the cover on the web page.
+
+    Sheet music is black on white, so a gray colorspace, a palette of a
+    few colors (2 meaning 1-bit) or a lossy format saves most of the
+    bytes of a cover. The format is given by the suffix of the cover:
+    .png, .jpg or .webp. Palettes and WebP need Pillow."""
+    COLORSPACES: ClassVar[dict] = {"rgb": csRGB, "gray": csGRAY}
+
+    width: int = 280
+    height: int = 420
+    colorspace: str = "rgb"
+    clip: tuple[float, float, float, float] | None = None
+    colors: int = 0
+    quality: int = 80
+
+    @property
+    def key(self) -> str:
+        """Key of the settings, for the cover cache."""
+        return (f"page=0,size={self.width}x{self.height},"
+                f"colorspace={self.colorspace},clip={self.clip},"
+                f"colors={self.colors},quality={self.quality}")
+
+    def matrix(self, area: Rect) -> Matrix:
+        """Return the scaling matrix to fit area in the cover size."""
+        zoom = min(self.width / area.width, self.height / area.height)
+        return Matrix(zoom, zoom)
+
+@dataclass(frozen=True)
+class RenderLimits:
+    """Limits of the rendering of each cover, so a malformed or huge pdf
+    cannot stall the build.
+
+    Without limits the covers are rendered in the worker processes of a
+    pool. With limits they are rendered by RenderWorker processes, with
+    their address space capped to max_memory bytes (the resident size
+    is not enforced by Linux); a cover taking more than timeout seconds
+    has its worker killed and replaced."""
+    timeout: float | None = None
+    max_memory: int | None = None
+
+    def __bool__(self) -> bool:
+        return self.timeout is not None or self.max_memory is not None
+
+    def executor(self, jobs: int = 1) -> Executor:
+        """Return a pool to render covers in jobs processes at a time (one
+        per CPU if jobs == 0)."""
+        if self:
+            return IsolatedRenderers(self, jobs or os.cpu_count())
+        return ProcessPoolExecutor(max_workers=jobs or None)
+
+@cache
+def renderer_context() -> multiprocessing.context.BaseContext:
+    """Return the multiprocessing context of the isolated renderers:
+    forked from a small server process that has already imported this
+    module, where available."""
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["__main__", __name__])
+    return context
+
+def render_worker(connection, max_memory: int | None) -> None:
+    """Render the covers of the CoverGenerator received from connection,
+    one at a time, sending back each result, or error, with its phases,
+    until the connection is closed."""
+    if max_memory and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+    connection.send(None)       # ready: startup is not timed
+    while True:
+        try:
+            generator = connection.recv()
+        except EOFError:
+            return
+        phases = {}
+        try:
+            result = True, generator.render(phases)
+        except Exception as error:   # MuPDF errors may not pickle
+            result = False, f"{type(error).__name__}: {error}"
+        # keep the memory of MuPDF's cache of documents within the limit
+        TOOLS.store_shrink(100)
+        connection.send((*result, phases))
+
+@dataclass
+class RenderWorker:
+    """A child process rendering covers one at a time within limits.
+
+    The process is started with the first cover and reused for the
+    next ones, so its startup is paid once; it is killed when a cover
+    runs out of time and replaced if it dies."""
+    limits: RenderLimits
+    process: multiprocessing.process.BaseProcess | None = None
+    connection: Any = None
+
+    def start(self) -> None:
+        """Start the process and wait until it is ready."""
+        context = renderer_context()
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=render_worker,
+            args=(child_connection, self.limits.max_memory), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.connection.recv()
+
+    def stop(self) -> None:
+        """Stop the process, if started."""
+        if self.process is None:
+            return
+        self.connection.close()
+        self.process.kill()
+        self.process.join()
+        self.process = self.connection = None
+
+    def render(self, generator: "CoverGenerator",
+               phases: dict[str, float] | None = None
+               ) -> tuple[str, PdfInfo]:
+        """Render the cover of generator like CoverGenerator.render, in
+        the process. The phases of the process are set in phases, if
+        given.
+
+        Raise TimeoutError if the cover runs out of time and
+        RuntimeError if rendering fails or the process dies."""
+        if self.process is None:
+            self.start()
+        try:
+            self.connection.send(generator)
+            done = self.connection.poll(self.limits.timeout)
+            if done:
+                ok, result, worker_phases = self.connection.recv()
+        except (EOFError, OSError):     # the process died
+            self.process.join()
+            exitcode = self.process.exitcode
+            self.stop()
+            raise RuntimeError(f"renderer died (exit code {exitcode})"
+                               ) from None
+        if not done:
+            self.stop()
+            raise TimeoutError(f"no cover after {self.limits.timeout} s")
+        if not ok:
+            raise RuntimeError(result)
+        if phases is not None:
+            phases.update(worker_phases)
+        return result
+
+class IsolatedRenderers(ThreadPoolExecutor):
+    """Pool of threads rendering covers within limits, each one through
+    a RenderWorker of its own, stopped when the pool shuts down."""
+
+    def __init__(self, limits: RenderLimits, max_workers: int):
+        super().__init__(max_workers)
+        self.limits = limits
+        self.idle = queue.SimpleQueue()
+        self.workers = []
+
+    def render(self, generator: "CoverGenerator",
+               phases: dict[str, float] | None = None
+               ) -> tuple[str, PdfInfo]:
+        """Render the cover of generator through an idle RenderWorker, or
+        a new one."""
+        try:
+            worker = self.idle.get_nowait()
+        except queue.Empty:
+            worker = RenderWorker(self.limits)
+            self.workers.append(worker)
+        try:
+            return worker.render(generator, phases)
+        finally:
+            self.idle.put(worker)
+
+    def shutdown(self, wait: bool = True, **kwargs) -> None:
+        super().shutdown(wait, **kwargs)
+        if wait:
+            for worker in self.workers:
+                worker.stop()
+
+def lap(start: float) -> tuple[float, float]:
+    """Return the seconds since start and the time now."""
+    now = time.perf_counter()
+    return now - start, now
+
+def render_timed(render: Callable
+                 ) -> tuple[tuple[str, PdfInfo], dict[str, float]]:
+    """Render a cover with the render function and return the result of
+    the rendering and its phases, with the whole time as "cover"."""
+    phases = {"cover": 0.0}     # first, in the order of the stages
+    start = time.perf_counter()
+    result = render(phases=phases)
+    phases["cover"], _ = lap(start)
+    return result, phases
 
 @dataclass
 class CoverGenerator:
     pdf: Path
     cover: Path
+    settings: CoverSettings = field(default_factory=CoverSettings)
+
+    def render(self, phases: dict[str, float] | None = None
+               ) -> tuple[str, PdfInfo]:
+        """Render the first page of pdf, save it to cover and return a
+        placeholder of the cover and the PdfInfo of pdf, read while the
+        document is open.
+
+        If phases is given, the seconds spent opening the pdf,
+        rasterizing the page, saving the cover and making the
+        placeholder are set in it."""
+        print(f"Creating cover for {self.pdf} ...")
+        phases = {} if phases is None else phases
+        start = time.perf_counter()
+        with PdfDocument(self.pdf) as document:
+            pdfinfo = PdfInfo.from_document(document, self.pdf)
+            page = document[0]
+            area = page.rect
+            if self.settings.clip:
+                area = Rect(self.settings.clip)
+            phases["cover.open"], start = lap(start)
+            cover_image = page.get_pixmap(
+                matrix=self.settings.matrix(area),
+                colorspace=CoverSettings.COLORSPACES[self.settings.colorspace],
+                clip=area,
+                alpha=False)
+            phases["cover.rasterize"], start = lap(start)
+            self.save(cover_image)
+            phases["cover.save"], start = lap(start)
+        placeholder = self.make_placeholder(cover_image)
+        phases["cover.placeholder"], _ = lap(start)
+        return placeholder, pdfinfo
+
+    @staticmethod
+    def make_placeholder(cover_image: Pixmap) -> str:
+        """Return a tiny grayscale version of the cover image as a data
+        URI of a few hundred bytes, to show while the cover loads."""
+        if cover_image.colorspace.n == 1:
+            thumbnail = Pixmap(cover_image)
+        else:
+            thumbnail = Pixmap(csGRAY, cover_image)
+        thumbnail.shrink(PLACEHOLDER_SHRINK)
+        png = base64.b64encode(thumbnail.tobytes("png")).decode("ascii")
+        return f"data:image/png;base64,{png}"
+
+    def save(self, cover_image: Pixmap) -> None:
+        """Save the cover image to cover in the format of its suffix."""
+        suffix = self.cover.suffix.lower()
+        if suffix in (".jpg", ".jpeg") and self.settings.colors:
+            raise ValueError("JPEG covers cannot have a palette")
+        if suffix == ".png" and not self.settings.colors:
+            cover_image.save(self.cover)
+        elif suffix in (".jpg", ".jpeg"):
+            cover_image.save(self.cover, jpg_quality=self.settings.quality)
+        else:
+            image = cover_image.pil_image()
+            if self.settings.colors == 2:
+                image = image.convert("1")
+            elif self.settings.colors:
+                image = image.quantize(self.settings.colors)
+            image.save(self.cover, quality=self.settings.quality,
+                       optimize=True)
 
     def make_cover(self) -> None:
         """Creates a cover from pdf if it does not exist and
         save it to cover."""
         if not self.cover.exists():
-            print(f"Creating cover for {self.pdf} ...")
-            cover_image = PdfDocument(self.pdf).get_page_pixmap(0)
-            cover_image.save(self.cover)
+            self.render()
+
+    @classmethod
+    def make_covers(cls, scores: list[Score], jobs: int = 1,
+                    cache: CoverCache | None = None,
+                    settings: CoverSettings = CoverSettings()) -> list[Path]:
+        """Create the covers of the given scores and return their paths
+        in the same order.
+
+        Without a cache, only missing covers are created. With a cache,
+        covers whose pdf has changed are created again and the cache is
+        updated. The placeholder of each score is set from the rendered
+        covers or the cache.
+
+        With jobs > 1 (or jobs == 0, meaning one per CPU) the covers are
+        rendered in a pool of processes, each one opening its own PDF
+        documents."""
+        CoverBatch.from_scores(scores, cache, settings).run(jobs)
+        return [s.cover for s in scores]
+
+@dataclass
+class CoverBatch:
+    """Covers to render for a batch of scores.
+
+    Constructing the batch finds out the pending covers, those missing
+    or stale, and sets the placeholders and PdfInfo of the rest from the
+    cache, without opening their pdf, so
+    the pending covers can be rendered now, started in the background
+    while the page is written, or skipped.
+
+    Duplicates sharing a cover, grouped by duplicates.find_duplicates,
+    are rendered once: the first one of the batch is rendered and the
+    rest, its copies, get the same placeholder and PdfInfo, as do scores
+    of the same pdf. Any other score whose cover is that of another pdf fails,
+    rather than showing the cover of the other pdf.
+
+    A cover that fails to render, or breaks the limits, does not stop
+    the batch: its score gets the blank cover and the error is recorded
+    in failures, keyed by pdf path.
+
+    With timings, the time spent on each cover rendered, and on each of
+    its phases, is added to them, labelled with the pdf path."""
+    scores: list[Score]
+    pending: list[Score]
+    cache: CoverCache | None = None
+    settings: CoverSettings = CoverSettings()
+    limits: RenderLimits = RenderLimits()
+    failures: dict[str, str] = field(default_factory=dict)
+    copies: dict[str, list[Score]] = field(default_factory=dict)
+    timings: Timings | None = None
+    pool: Executor | None = field(default=None, repr=False)
+    futures: list[Future] = field(default_factory=list, repr=False)
+
+    @classmethod
+    def from_scores(cls, scores: Iterable[Score],
+                    cache: CoverCache | None = None,
+                    settings: CoverSettings = CoverSettings(),
+                    priority: Callable[[Score], Any] | None = None,
+                    limits: RenderLimits = RenderLimits(),
+                    timings: Timings | None = None,
+                    duplicates: Iterable[list[Score]] = ()) -> Self:
+        """Construct the CoverBatch of the given scores, sharing the
+        covers of the groups of duplicates. Pending covers are rendered
+        in the order of the scores, or by priority if given, within
+        limits, and timed in timings if given."""
+        scores = list(scores)
+        # whichever score of a group comes first is rendered, and the
+        # copies are keyed by its pdf
+        groups = {id(s): i for i, group in enumerate(duplicates)
+                  for s in group}
+        firsts, copies, clashes = {}, {}, []
+        for s in scores:
+            first = firsts.setdefault(s.cover, s)
+            if first is s:
+                continue
+            group = groups.get(id(s))
+            if (s.path == first.path
+                    or group is not None and group == groups.get(id(first))):
+                copies.setdefault(str(first.path), []).append(s)
+            else:
+                clashes.append((s, first))
+        if cache is None:
+            pending = [s for s in firsts.values() if not s.cover.exists()]
+        else:
+            pending = [s for s in firsts.values()
+                       if not cache.is_fresh(s.path, s.cover, settings.key)]
+            reused = cache.reuse(((s.path, s.cover) for s in pending),
+                                 settings.key)
+            pending = [s for s in pending if s.cover not in reused]
+            pending_covers = {s.cover for s in pending}
+            for s in scores:
+                if s.cover not in pending_covers:
+                    s.placeholder = cache.placeholder(s.cover)
+                    pdfinfo = cache.pdfinfo(s.cover)
+                    s.pdfinfo = pdfinfo and PdfInfo(**pdfinfo)
+        if priority is not None:
+            pending.sort(key=priority)
+        coverbatch = cls(scores, pending, cache, settings, limits,
+                         copies=copies, timings=timings)
+        for s, first in clashes:
+            coverbatch.fail(s, ValueError(f"cover {s.cover} is also the "
+                                          f"cover of {first.path}"))
+        return coverbatch
+
+    def generators(self) -> list[CoverGenerator]:
+        """Return the CoverGenerator of the pending covers."""
+        for cover_dir in {s.cover.parent for s in self.pending}:
+            cover_dir.mkdir(parents=True, exist_ok=True)
+        return [CoverGenerator(s.path, s.cover, self.settings)
+                for s in self.pending]
+
+    def task(self, generator: CoverGenerator,
+             pool: Executor | None = None) -> Callable:
+        """Return the function rendering the cover of generator in pool,
+        if given, timed if there are timings."""
+        if isinstance(pool, IsolatedRenderers):
+            render = partial(pool.render, generator)
+        else:
+            render = generator.render
+        if self.timings is None:
+            return render
+        return partial(render_timed, render)
+
+    def complete(self, s: Score, result: tuple) -> None:
+        """Record the result of the task rendering the cover of s."""
+        if self.timings is not None:
+            result, phases = result
+            self.timings.add_phases(phases, str(s.path))
+        self.record(s, *result)
+
+    def record(self, s: Score, placeholder: str, pdfinfo: PdfInfo) -> None:
+        """Record that the cover of s, and its copies, has been
+        rendered."""
+        for copy in [s, *self.copies.get(str(s.path), [])]:
+            copy.placeholder = placeholder
+            copy.pdfinfo = pdfinfo
+        if self.cache is not None:
+            self.cache.update(s.path, s.cover, self.settings.key,
+                              placeholder, asdict(pdfinfo))
+
+    def fail(self, s: Score, error: Exception) -> None:
+        """Record that the cover of s, and its copies, could not be
+        rendered."""
+        for copy in [s, *self.copies.get(str(s.path), [])]:
+            copy.cover = BLANK_COVER
+            copy.placeholder = ""
+            copy.pdfinfo = None
+            self.failures[str(copy.path)] = (str(error)
+                                             or type(error).__name__)
+
+    def start(self, jobs: int = 1) -> Self:
+        """Start rendering the pending covers in the background, in a pool
+        of jobs processes (one per CPU if jobs == 0)."""
+        self.pool = self.limits.executor(jobs)
+        self.futures = [self.pool.submit(self.task(g, self.pool))
+                        for g in self.generators()]
+        return self
+
+    def wait(self) -> list[Score]:
+        """Wait for the covers started and return their scores."""
+        for s, future in zip(self.pending, self.futures):
+            try:
+                self.complete(s, future.result())
+            except Exception as error:
+                self.fail(s, error)
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        return self.pending
 
+    def run(self, jobs: int = 1) -> list[Score]:
+        """Render the pending covers, in a pool of processes if jobs is
+        not 1 or there are limits, and return their scores."""
+        if jobs != 1 or self.limits:
+            return self.start(jobs).wait()
+        for s, generator in zip(self.pending, self.generators()):
+            try:
+                self.complete(s, self.task(generator)())
+            except Exception as error:
+                self.fail(s, error)
+        return self.pending
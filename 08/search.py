@@ -0,0 +1,77 @@
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing_extensions import Self # in >3.10: from typing ...
+
+from cache import dump_json
+from score import ScoreArchive
+
+SEARCH_DIR = Path("search")
+SEARCH_INDEX = "index.json"
+# tokens have no hyphen, so no shard can be named as the index
+SEARCH_SHARD = "t-{}.json"
+SEARCH_FIELDS = ["composer", "work", "editor"]
+
+def fold(s: str) -> str:
+    """Remove the accents of s and convert it to lowercase."""
+    s = unicodedata.normalize("NFKD", s)
+    return "".join(c for c in s if not unicodedata.combining(c)).lower()
+
+def tokenize(s: str) -> list[str]:
+    """Split s into accent-folded tokens."""
+    return re.findall(r"[^\W_]+", fold(s))
+
+@dataclass
+class SearchIndex:
+    """Index of the tokens of the ScoreRecord fields.
+
+    Records are identified by their position in the pages of the web
+    page, in page order, and each page by its href and the id of its
+    first record."""
+    tokens: dict[str, list[int]] = field(default_factory=dict)
+    pages: list[tuple[str, int]] = field(default_factory=list)
+
+    @classmethod
+    def from_pages(cls, pages: list[tuple[str, ScoreArchive]]) -> Self:
+        """Construct the SearchIndex of the given (href, ScoreArchive)
+        pages."""
+        tokens = defaultdict(list)
+        pagemap = []
+        record_id = 0
+        for href, scorearchive in pages:
+            pagemap.append((href, record_id))
+            for sr in scorearchive:
+                text = " ".join(getattr(sr, f) for f in SEARCH_FIELDS)
+                for token in dict.fromkeys(tokenize(text)):
+                    tokens[token].append(record_id)
+                record_id += 1
+        return cls(dict(tokens), pagemap)
+
+    def shards(self, prefix_length: int) -> dict[str, dict[str, list[int]]]:
+        """Split the tokens by their first prefix_length characters."""
+        shards = defaultdict(dict)
+        for token, record_ids in sorted(self.tokens.items()):
+            shards[token[:prefix_length]][token] = record_ids
+        return dict(shards)
+
+    def write(self, directory: Path = SEARCH_DIR,
+              prefix_length: int = 2) -> list[Path]:
+        """Write the SearchIndex to directory, as an index file and a
+        file per shard, delete the shards of former indexes, and return
+        the files written."""
+        directory.mkdir(parents=True, exist_ok=True)
+        shards = self.shards(prefix_length)
+        written = []
+        for prefix, tokens in shards.items():
+            written.append(Path(directory, SEARCH_SHARD.format(prefix)))
+            dump_json(written[-1], tokens)
+        index = Path(directory, SEARCH_INDEX)
+        dump_json(index, {"prefix_length": prefix_length,
+                          "shards": sorted(shards),
+                          "pages": self.pages})
+        for former in directory.glob("*.json"):
+            if former != index and former not in written:
+                former.unlink()
+        return written + [index]
@@ -0,0 +1,162 @@
+import os
+import pytest
+from cache import (BuildManifest, CoverCache, Fingerprint, FragmentCache,
+                   ParseCache, atomic_open, dump_json, file_digest, load_json,
+                   scan_fingerprints)
+
+# Examples --------------------------------------------------------------
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "Anónimo_Greensleeves.pdf"
+    path.write_bytes(b"%PDF-1.4 Greensleeves")
+    return path
+
+@pytest.fixture
+def cover(tmp_path):
+    path = tmp_path / "img" / "Anónimo_Greensleeves.png"
+    path.parent.mkdir()
+    path.write_bytes(b"PNG")
+    return path
+
+@pytest.fixture
+def covercache(tmp_path, pdf, cover):
+    covercache = CoverCache(tmp_path / "covers.json")
+    covercache.update(pdf, cover, "page=0")
+    return covercache
+
+# Tests -----------------------------------------------------------------
+## Utils
+def test_json_roundtrip(tmp_path):
+    dump_json(tmp_path / "a.json", {"Tárrega": [1, 2]})
+    assert load_json(tmp_path / "a.json", None) == {"Tárrega": [1, 2]}
+    assert load_json(tmp_path / "missing.json", {}) == {}
+
+def test_atomic_open_error_keeps_file(tmp_path):
+    path = tmp_path / "partituras.html"
+    path.write_text("old")
+    with pytest.raises(RuntimeError):
+        with atomic_open(path) as f:
+            f.write("half")
+            raise RuntimeError
+    assert path.read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["partituras.html"]
+
+def test_fingerprint_of(pdf):
+    assert Fingerprint.of(pdf).size == len(b"%PDF-1.4 Greensleeves")
+
+## CoverCache methods
+def test_covercache_is_fresh(covercache, pdf, cover):
+    assert covercache.is_fresh(pdf, cover, "page=0")
+    assert not covercache.is_fresh(pdf, cover, "page=1")
+
+def test_covercache_touched_pdf_is_fresh(covercache, pdf, cover):
+    os.utime(pdf, ns=(0, 0))
+    assert covercache.is_fresh(pdf, cover, "page=0")
+    assert covercache.entries[str(cover)]["mtime_ns"] == 0
+
+def test_covercache_changed_pdf_is_stale(covercache, pdf, cover):
+    pdf.write_bytes(b"%PDF-1.4 Greensleeves, revised")
+    assert not covercache.is_fresh(pdf, cover, "page=0")
+
+def test_covercache_reuse(covercache, pdf, cover, tmp_path):
+    moved = tmp_path / "Anónimo" / pdf.name
+    moved.parent.mkdir()
+    pdf.rename(moved)
+    moved_cover = tmp_path / "img" / "Anónimo" / cover.name
+    assert covercache.reuse([(moved, moved_cover)], "page=1") == set()
+    assert covercache.reuse([(moved, moved_cover)], "page=0") == {
+        moved_cover}
+    assert moved_cover.read_bytes() == b"PNG"
+    assert covercache.is_fresh(moved, moved_cover, "page=0")
+
+def test_covercache_save_load(covercache, pdf, cover):
+    covercache.save()
+    loaded = CoverCache.load(covercache.index)
+    assert loaded.entries[str(cover)]["digest"] == file_digest(pdf)
+
+def test_covercache_collect_garbage(covercache, cover):
+    assert covercache.collect_garbage([cover]) == []
+    assert covercache.collect_garbage([]) == [cover]
+    assert not cover.exists()
+    assert covercache.entries == {}
+
+## BuildManifest methods
+def test_buildmanifest_lookup(tmp_path, pdf):
+    manifest = BuildManifest(tmp_path / "manifest.json")
+    assert manifest.lookup(pdf) is None
+    manifest.record(pdf, {"composer": "Anónimo"})
+    assert manifest.lookup(pdf) == {"composer": "Anónimo"}
+    pdf.write_bytes(b"%PDF-1.4 Greensleeves, revised")
+    assert manifest.lookup(pdf) is None
+
+def test_buildmanifest_save_load(tmp_path, pdf):
+    manifest = BuildManifest(tmp_path / "manifest.json")
+    manifest.record(pdf, {"composer": "Anónimo"})
+    manifest.save()
+    assert not manifest.changed
+    loaded = BuildManifest.load(manifest.path)
+    assert loaded.lookup(pdf) == {"composer": "Anónimo"}
+
+def test_buildmanifest_prune(tmp_path, pdf):
+    manifest = BuildManifest(tmp_path / "manifest.json")
+    manifest.record(pdf, {"composer": "Anónimo"})
+    manifest.changed = False
+    assert manifest.prune([pdf]) == []
+    assert not manifest.changed
+    assert manifest.prune([]) == [pdf]
+    assert manifest.changed
+
+def test_buildmanifest_is_current(tmp_path, pdf):
+    manifest = BuildManifest(tmp_path / "manifest.json")
+    assert not manifest.is_current(scan_fingerprints(pdf.parent))
+    manifest.record(pdf, {"composer": "Anónimo"})
+    assert manifest.is_current(scan_fingerprints(pdf.parent))
+    pdf.write_bytes(b"%PDF-1.4 Greensleeves, revised")
+    assert not manifest.is_current(scan_fingerprints(pdf.parent))
+
+def test_buildmanifest_version(tmp_path, pdf):
+    manifest = BuildManifest(tmp_path / "manifest.json", version="1")
+    manifest.record(pdf, {"composer": "Anónimo"})
+    manifest.save()
+    assert BuildManifest.load(manifest.path, "1").lookup(pdf)
+    assert BuildManifest.load(manifest.path, "2").entries == {}
+
+def test_buildmanifest_options(tmp_path, pdf):
+    manifest = BuildManifest(tmp_path / "manifest.json")
+    manifest.record(pdf, {"composer": "Anónimo"})
+    manifest.use_options("a")
+    manifest.save()
+    manifest = BuildManifest.load(manifest.path)
+    fingerprints = scan_fingerprints(pdf.parent)
+    assert manifest.is_current(fingerprints, "a")
+    assert not manifest.is_current(fingerprints, "b")
+
+## ParseCache methods
+def test_parsecache_lru(tmp_path):
+    parse_cache = ParseCache(tmp_path / "names.json", max_entries=2)
+    parse_cache.put("a_b", {"composer": "a"})
+    parse_cache.put("c_d", {"composer": "c"})
+    assert parse_cache.get("a_b") == {"composer": "a"}
+    parse_cache.put("e_f", {"composer": "e"})
+    assert list(parse_cache.entries) == ["a_b", "e_f"]
+    assert parse_cache.get("c_d") is None
+
+def test_parsecache_save_load(tmp_path):
+    parse_cache = ParseCache(tmp_path / "names.json", "1")
+    parse_cache.put("a_b", {"composer": "a"})
+    parse_cache.save()
+    assert not parse_cache.changed
+    assert ParseCache.load(parse_cache.path, "1").get("a_b")
+    assert ParseCache.load(parse_cache.path, "2").entries == {}
+
+## FragmentCache methods
+def test_fragmentcache(tmp_path):
+    fragment_cache = FragmentCache(tmp_path / "fragments.json", "1")
+    assert fragment_cache.get("a") is None
+    fragment_cache.put("a", "<p>a</p>")
+    fragment_cache.save()
+    loaded = FragmentCache.load(fragment_cache.path, "1")
+    assert loaded.get("a") == "<p>a</p>"
+    assert loaded.get("b") is None
+    assert loaded.hit_rate() == 0.5
+    assert FragmentCache.load(fragment_cache.path, "2").entries == {}
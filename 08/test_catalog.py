@@ -0,0 +1,83 @@
+import pytest
+from score import PdfInfo, Score, ScoreArchive
+from catalog import Catalog
+
+# Examples --------------------------------------------------------------
+@pytest.fixture
+def scores(tmp_path):
+    scores = []
+    for name in ["Francisco-Tárrega_Lágrima.pdf",
+                 "Anónimo_Greensleeves.pdf",
+                 "Francisco-Tárrega_Adelita.pdf",
+                 "Luis-Milán_Pavana-II_Orfeo.pdf"]:
+        path = tmp_path / name
+        path.write_bytes(b"%PDF")
+        scores.append(Score(path))
+    return scores
+
+@pytest.fixture
+def catalog(tmp_path, scores):
+    with Catalog.open(tmp_path / "catalog.sqlite") as catalog:
+        catalog.add_scores(scores)
+        yield catalog
+
+# Tests -----------------------------------------------------------------
+def test_catalog_select_in_page_order(catalog, scores):
+    assert list(catalog.select()) == ScoreArchive.from_scores(scores).sort()
+
+def test_catalog_select_prefix(catalog):
+    assert [sr.work for sr in catalog.select(composer="tárr")] == [
+        "Adelita", "Lágrima"]
+    assert [sr.work for sr in catalog.select(work="PAV")] == ["Pavana II"]
+    assert [sr.composer for sr in catalog.select(editor="orf")] == [
+        "Luis Milán"]
+    assert catalog.count(composer="Tá", work="l") == 1
+    assert [sr.work for sr in catalog.select(limit=1, offset=1)] == [
+        "Pavana II"]
+
+def test_catalog_upsert(catalog, scores):
+    scorearchive = ScoreArchive.from_scores(scores[:1])
+    scorearchive[0].score.placeholder = "data:image/png;base64,"
+    scorearchive[0].score.pdfinfo = PdfInfo(pages=3)
+    catalog.upsert(scorearchive)
+    assert catalog.count() == 4
+    lagrima, = catalog.select(work="Lágrima")
+    assert lagrima.score.placeholder == "data:image/png;base64,"
+    assert lagrima.pdfinfo == PdfInfo(pages=3)
+    assert lagrima.score.cover == scores[0].cover
+
+def test_catalog_prune(catalog, scores):
+    assert catalog.prune(s.path for s in scores[1:]) == 1
+    assert catalog.count() == 3
+
+def test_catalog_changed(catalog, scores):
+    assert catalog.changed(scores) == []
+    scores[1].path.write_bytes(b"%PDF, revised")
+    assert catalog.changed(scores) == [scores[1]]
+    assert catalog.add_scores(scores) == ScoreArchive.from_scores(
+        scores[1:2])
+    assert catalog.changed(scores) == []
+    catalog.forget([scores[2].path])
+    assert catalog.changed(scores) == [scores[2]]
+
+def test_catalog_select_editions(tmp_path):
+    scores = []
+    for name in ["b/Francisco-Tárrega_Marieta.pdf",
+                 "Francisco-Tárrega_Marieta_Orfeo+Tracio.pdf",
+                 "a/Francisco-Tárrega_Marieta.pdf",
+                 "Francisco-Tárrega_Marieta_Antich-y-Tena.pdf"]:
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b"%PDF")
+        scores.append(Score(path))
+    with Catalog.open(tmp_path / "catalog.sqlite") as catalog:
+        catalog.add_scores(scores)
+        assert [sr.score.path for sr in catalog.select()] == [
+            sr.score.path for sr in ScoreArchive.from_scores(scores).sort()]
+
+def test_catalog_write_html(catalog, scores, tmp_path):
+    catalog.write_html(tmp_path / "catalog.html")
+    ScoreArchive.from_scores(scores).sort().write_html(
+        tmp_path / "archive.html")
+    assert ((tmp_path / "catalog.html").read_text()
+            == (tmp_path / "archive.html").read_text())
@@ -0,0 +1,31 @@
+import pytest
+from pathlib import Path
+from discovery import walk_files
+
+# Examples --------------------------------------------------------------
+@pytest.fixture
+def scoretree(tmp_path):
+    for name in ["Anónimo_Greensleeves.pdf", "notes.txt", ".DS_Store",
+                 "Tárrega/Francisco-Tárrega_Adelita.PDF",
+                 "Tárrega/Lágrima/Francisco-Tárrega_Lágrima.pdf",
+                 ".hidden/Luis-Milán_Pavana-II.pdf"]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"%PDF")
+    return tmp_path
+
+# Tests -----------------------------------------------------------------
+def test_walk_files(scoretree):
+    found = sorted(Path(e.path).relative_to(scoretree).as_posix()
+                   for e in walk_files(scoretree))
+    assert found == ["Anónimo_Greensleeves.pdf",
+                     "Tárrega/Francisco-Tárrega_Adelita.PDF",
+                     "Tárrega/Lágrima/Francisco-Tárrega_Lágrima.pdf"]
+
+def test_walk_files_suffixes(scoretree):
+    found = [e.name for e in walk_files(scoretree, (".txt",))]
+    assert found == ["notes.txt"]
+
+def test_walk_files_is_lazy(scoretree):
+    entries = walk_files(scoretree)
+    assert next(entries).name.lower().endswith(".pdf")
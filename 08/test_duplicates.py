@@ -0,0 +1,77 @@
+import pytest
+from pymupdf import Document as PdfDocument
+from score import BLANK_COVER, CoverBatch, Score
+from duplicates import find_duplicates, share_covers
+
+# Examples --------------------------------------------------------------
+@pytest.fixture
+def scores(tmp_path):
+    contents = {"Francisco-Tárrega_Marieta_Antich-y-Tena.pdf": b"%PDF A",
+                "Francisco-Tárrega_Marieta_Orfeo+Tracio.pdf": b"%PDF B",
+                "Francisco-Tárrega_Marieta.pdf": b"%PDF A",
+                "Anónimo_Greensleeves.pdf": b"%PDF C, larger"}
+    scores = []
+    for name, content in contents.items():
+        path = tmp_path / name
+        path.write_bytes(content)
+        scores.append(Score(path))
+    return scores
+
+@pytest.fixture
+def pdfs(tmp_path):
+    paths = [tmp_path / "Anónimo_Greensleeves.pdf",
+             tmp_path / "Anónimo_Greensleeves_Copia.pdf"]
+    with PdfDocument() as document:
+        document.new_page(width=600, height=900)
+        document.save(paths[0])
+    paths[1].write_bytes(paths[0].read_bytes())
+    return paths
+
+# Tests -----------------------------------------------------------------
+def test_find_duplicates(scores):
+    assert find_duplicates(scores) == [[scores[2], scores[0]]]
+
+def test_share_covers(pdfs, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scores = [Score(pdf) for pdf in pdfs]
+    identical = find_duplicates(scores)
+    assert identical == [scores]
+    share_covers(identical)
+    assert scores[1].cover == scores[0].cover
+    coverbatch = CoverBatch.from_scores(scores, duplicates=identical)
+    assert coverbatch.pending == [scores[0]]
+    coverbatch.run()
+    assert scores[1].placeholder == scores[0].placeholder != ""
+
+def test_share_covers_copy_first(pdfs, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scores = [Score(pdf) for pdf in reversed(pdfs)]   # the copy first
+    identical = find_duplicates(scores)
+    assert identical == [scores[::-1]]
+    share_covers(identical)
+    coverbatch = CoverBatch.from_scores(scores, duplicates=identical)
+    assert coverbatch.pending == [scores[0]]
+    coverbatch.run()
+    assert not coverbatch.failures
+    assert scores[1].cover == scores[0].cover != BLANK_COVER
+    assert scores[1].placeholder == scores[0].placeholder != ""
+
+def test_cover_clash(pdfs, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scores = [Score(pdf) for pdf in pdfs]
+    scores[1].cover = scores[0].cover   # not grouped as duplicates
+    coverbatch = CoverBatch.from_scores(scores)
+    assert coverbatch.pending == [scores[0]]
+    coverbatch.run()
+    assert scores[0].placeholder
+    assert scores[1].cover == BLANK_COVER and not scores[1].placeholder
+    assert "is also the cover of" in coverbatch.failures[str(pdfs[1])]
+
+def test_find_near_duplicates(pdfs, tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    from duplicates import find_near_duplicates, perceptual_hash
+    monkeypatch.chdir(tmp_path)
+    scores = [Score(pdf) for pdf in pdfs]
+    CoverBatch.from_scores(scores).run()
+    assert perceptual_hash(scores[0].placeholder) == 0   # a blank page
+    assert find_near_duplicates(scores) == [(scores[0], scores[1], 0)]
@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from pathlib import Path
+from pymupdf import Document as PdfDocument
+from cache import BuildManifest, CoverCache
+from pipeline import build_archive
+
+# Examples --------------------------------------------------------------
+@pytest.fixture
+def scoretree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ["Francisco-Tárrega_Lágrima.pdf",
+                 "Anónimo_Greensleeves.pdf",
+                 "Bach/Johann-Sebastian-Bach_Preludio_BWV-998.pdf"]:
+        path = tmp_path / "scores" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with PdfDocument() as document:
+            document.new_page(width=600, height=900)
+            document.save(path)
+    return tmp_path / "scores"
+
+# Tests -----------------------------------------------------------------
+def test_build_archive(scoretree):
+    covercache = CoverCache(Path("covers.json"))
+    manifest = BuildManifest(Path("manifest.json"))
+    scorearchive = asyncio.run(build_archive(
+        scoretree, manifest, covercache, concurrency=2, jobs=1,
+        queue_size=1))
+    assert [sr.composer for sr in scorearchive] == [
+        "Anónimo", "Johann Sebastian Bach", "Francisco Tárrega"]
+    for sr in scorearchive:
+        assert sr.score.cover.exists()
+        assert sr.score.placeholder.startswith("data:image/png;base64,")
+        assert sr.pdfinfo.pages == 1
+    assert len(covercache.entries) == len(manifest.entries) == 3
+
+def test_build_archive_empty(tmp_path):
+    assert asyncio.run(build_archive(tmp_path, jobs=1)) == []
+
+def test_build_archive_identical(scoretree):
+    copy = scoretree / "Francisco-Tárrega_Lágrima_Copia.pdf"
+    copy.write_bytes((scoretree / "Anónimo_Greensleeves.pdf").read_bytes())
+    covercache = CoverCache(Path("covers.json"))
+    failures, identical = {}, []
+    scorearchive = asyncio.run(build_archive(
+        scoretree, cache=covercache, concurrency=2, jobs=1, queue_size=1,
+        failures=failures, identical=identical))
+    assert len(scorearchive) == 4 and not failures
+    assert [[s.path.name for s in group] for group in identical] == [
+        ["Anónimo_Greensleeves.pdf", "Francisco-Tárrega_Lágrima_Copia.pdf"]]
+    original, copy = identical[0]
+    assert copy.cover == original.cover
+    assert copy.placeholder == original.placeholder != ""
+    assert len(covercache.entries) == 3
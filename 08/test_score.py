@@ -0,0 +1,606 @@
+import pytest
+import random
+import unicodedata
+from pathlib import Path
+from lark.exceptions import LarkError
+from pymupdf import Document as PdfDocument, Pixmap
+from score import (BLANK_COVER, Score, ScoreRecord, ScoreArchive,
+                   CoverBatch, CoverGenerator, CoverSettings, RenderLimits,
+                   collate, discover_scores, html_environment,
+                   parse_score_name, parse_score_name_fast, parser_version,
+                   remove_shards, score_name_parser)
+
+# Examples --------------------------------------------------------------
+## Score
+@pytest.fixture
+def score1():
+    return Score(Path("Heitor-Villa+Lobos_Preludio-1_Max-Eschig.pdf"),
+                 with_cover=False)
+
+@pytest.fixture
+def score2():
+    return Score(Path("Heitor-Villa+Lobos_Preludio-1.pdf"),
+                 with_cover=False)
+
+@pytest.fixture
+def score3():
+    return Score(Path("Francisco-Tárrega_Adelita.pdf"),
+                 with_cover=False)
+
+@pytest.fixture
+def score4():
+    return Score(Path("Francesco-da-Milano_Fantasía_Ruggero-Chiesa.pdf"),
+                 with_cover=False)
+
+@pytest.fixture
+def score5():
+    return Score(Path("Anónimo_Greensleeves.pdf"),
+                 with_cover=False)
+
+@pytest.fixture
+def score6():
+    return Score(Path("Johann-Sebastian-Bach_Sarabande-BWV-995.pdf"),
+                 with_cover=False)
+
+@pytest.fixture
+def score7():
+    return Score(Path("Johann-Sebastian-Bach_Preludio-BWV-999.pdf"),
+                 with_cover=False)
+
+@pytest.fixture
+def score8():
+    return Score(Path("Carl-Philipp-Emanuel-Bach_Sonata.pdf"),
+                 with_cover=False)
+
+@pytest.fixture
+def score9():
+    return Score(Path("scores/Tárrega_Gran-Vals.pdf"),
+                 with_cover=False)
+
+## pdf
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "Anónimo_Greensleeves.pdf"
+    with PdfDocument() as document:
+        document.new_page(width=600, height=900)
+        document.save(path)
+    return path
+
+## list of Score
+@pytest.fixture
+def scores1(score3, score4, score5):
+    return [score3, score4, score5]
+
+## score dict
+@pytest.fixture
+def scoredict1(score1):
+    return {
+        "composer": "Heitor Villa-Lobos",
+        "work": "Preludio 1",
+        "editor": "Max Eschig",
+        "score": score1
+    }
+
+@pytest.fixture
+def scoredict2(score2):
+    return {
+        "composer": "Heitor Villa-Lobos",
+        "work": "Preludio 1",
+        "editor": "",
+        "score": score2
+    }
+
+## ScoreRecord
+@pytest.fixture
+def scorerecord1(score1):
+    return ScoreRecord(
+        composer="Heitor Villa-Lobos",
+        work="Preludio 1",
+        editor="Max Eschig",
+        score=score1
+    )
+
+@pytest.fixture
+def scorerecord3(score3):
+    return ScoreRecord.from_score(score3)
+
+@pytest.fixture
+def scorerecord4(score4):
+    return ScoreRecord.from_score(score4)
+
+@pytest.fixture
+def scorerecord5(score5):
+    return ScoreRecord.from_score(score5)
+
+@pytest.fixture
+def scorerecord6(score6):
+    return ScoreRecord.from_score(score6)
+
+@pytest.fixture
+def scorerecord7(score7):
+    return ScoreRecord.from_score(score7)
+
+@pytest.fixture
+def scorerecord8(score8):
+    return ScoreRecord.from_score(score8)
+
+## ScoreArchive
+@pytest.fixture
+def scorearchive1(scorerecord3, scorerecord4, scorerecord5):
+    return ScoreArchive([scorerecord3, scorerecord4, scorerecord5])
+
+@pytest.fixture
+def scorearchive2(scorerecord3, scorerecord5, scorerecord6, 
+                  scorerecord7, scorerecord8):
+    return ScoreArchive([scorerecord6, scorerecord5, scorerecord3,
+                         scorerecord7, scorerecord8])
+
+@pytest.fixture
+def scorearchive3(scorerecord3, scorerecord5, scorerecord6, 
+                  scorerecord7, scorerecord8):
+    return ScoreArchive([scorerecord5, scorerecord8, scorerecord7,
+                         scorerecord6, scorerecord3])
+
+## HTML
+@pytest.fixture
+def scorehtml1():
+    return """
+        <article class="score-record">
+          <div class="score-link">
+            <a download href="Heitor-Villa+Lobos_Preludio-1_Max-Eschig.pdf">
+            </a>
+          </div>
+          <div class="score-info">
+            <p class="composer">Heitor Villa-Lobos</p>
+            <p class="work">Preludio 1</p>
+            <p class="editor">Max Eschig</p>
+          </div>
+        </article>
+        """
+
+@pytest.fixture
+def scorearchivehtml1():
+    return """
+        <!DOCTYPE html>
+        <html lang="es">
+        <head>
+          <title>Web Partituras</title>
+          <meta charset="utf-8">
+          <link href="css/score.css" rel="stylesheet">
+        </head>
+        <body>
+          <h1>Web Partituras</h1>
+          <section class="score-archive">
+            <article class="score-record">
+                <div class="score-link">
+                  <a download href="Francisco-Tárrega_Adelita.pdf">
+                    <img src="img/Francisco-Tárrega_Adelita.png" alt="" loading="lazy"
+                         decoding="async">
+                  </a>
+                </div>
+                <div class="score-info">
+                  <p class="composer">Francisco Tárrega</p>
+                  <p class="work">Adelita</p>
+                  <p class="editor"></p>
+                </div>
+            </article>
+            <article class="score-record">
+                <div class="score-link">
+                  <a download href="Francesco-da-Milano_Fantasía_Ruggero-Chiesa.pdf">
+                    <img src="img/Francesco-da-Milano_Fantasía_Ruggero-Chiesa.png" alt="" loading="lazy"
+                         decoding="async">
+                  </a>
+                </div>
+                <div class="score-info">
+                  <p class="composer">Francesco da Milano</p>
+                  <p class="work">Fantasía</p>
+                  <p class="editor">Ruggero Chiesa</p>
+                </div>
+            </article>
+            <article class="score-record">
+                <div class="score-link">
+                  <a download href="Anónimo_Greensleeves.pdf">
+                    <img src="img/Anónimo_Greensleeves.png" alt="" loading="lazy"
+                         decoding="async">
+                  </a>
+                </div>
+                <div class="score-info">
+                  <p class="composer">Anónimo</p>
+                  <p class="work">Greensleeves</p>
+                  <p class="editor"></p>
+                </div>
+            </article>
+          </section>
+        </body>
+        </html>
+        """
+
+# Utils -----------------------------------------------------------------
+def normalize_html(element):
+    """Format HTML element to a single line."""
+    return "".join([s.strip() for s in element.split("\n")])
+
+# Tests -----------------------------------------------------------------
+## Score methods
+def test_score_to_dict(score1, scoredict1, score2, scoredict2):
+    assert score1.to_dict() == scoredict1
+    assert score2.to_dict() == scoredict2
+
+def test_score_post_init(score9):
+    # Assume: covers directory is 'img' and conver extensión is 'png'
+    assert score9.name == "Tárrega_Gran-Vals"
+    assert score9.cover == Path("img/Tárrega_Gran-Vals.png")
+
+## Score name parser
+def test_parse_score_name(scoredict1):
+    expected = {k: v for k, v in scoredict1.items() if k != "score"}
+    name = "Heitor-Villa+Lobos_Preludio-1_Max-Eschig"
+    assert parse_score_name(name) == expected
+
+def test_parse_score_name_whitespace():
+    # the LALR parser drops the whitespace at the start of a word, where
+    # the former Earley parser kept it (" b") or let a separator follow it
+    assert parse_score_name("abb_ b") == {"composer": "abb", "work": "b",
+                                          "editor": ""}
+    assert parse_score_name("a- b_c")["composer"] == "a b"
+    assert parse_score_name("a _b")["composer"] == "a "
+    with pytest.raises(LarkError):
+        parse_score_name("aa_ +b")
+
+def random_names(n: int, alphabet: str, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choices(alphabet, k=rng.randint(0, 12)))
+            for _ in range(n)]
+
+def lark_parse(name: str) -> dict | None:
+    try:
+        return score_name_parser().parse(name)
+    except LarkError:
+        return None
+
+def test_parse_score_name_fast_is_equivalent():
+    # without whitespace the fast path parses what the grammar parses
+    for name in random_names(20_000, "aáñ1.-+_"):
+        assert parse_score_name_fast(name) == lark_parse(name), name
+
+def test_parse_score_name_fast_falls_back():
+    # with whitespace the fast path gives up or agrees with the grammar
+    for name in random_names(20_000, "aá ñ-+_\t"):
+        fast = parse_score_name_fast(name)
+        assert fast is None or fast == lark_parse(name), name
+        if fast is None and lark_parse(name) is not None:
+            assert parse_score_name(name) == lark_parse(name)
+
+def test_manifest_version():
+    from score import manifest_version
+    assert manifest_version() != parser_version()
+    assert len(manifest_version()) == 16
+
+def test_score_name_parser_is_shared():
+    assert score_name_parser() is score_name_parser()
+
+## ScoreRecord methods
+def test_scorerecord_from_dict(scoredict1, scorerecord1):
+    assert ScoreRecord.from_dict(scoredict1) == scorerecord1
+
+def test_scorerecord_from_score(score1, scorerecord1):
+    assert ScoreRecord.from_score(score1) == scorerecord1
+
+def test_scorerecord_to_html(scorerecord1, scorehtml1):
+    assert (
+        normalize_html(scorerecord1.to_html()) 
+        == normalize_html(scorehtml1)
+    )
+
+def test_scorerecord_to_html_template_override(scorerecord1, tmp_path):
+    (tmp_path / "score.html").write_text("<p>{{scorerecord.work}}</p>")
+    environment = html_environment(tmp_path, tmp_path / "cache")
+    assert scorerecord1.to_html(environment) == "<p>Preludio 1</p>"
+    assert html_environment(tmp_path, tmp_path / "cache") is environment
+    assert list((tmp_path / "cache").iterdir())
+
+## ScoreArchive methods
+def test_scorearchive_from_scores(scores1, scorearchive1):
+    assert ScoreArchive.from_scores(scores1) == scorearchive1
+        
+def test_scorearchive_sort(scorearchive2, scorearchive3):
+    assert scorearchive2.sort() == scorearchive3
+
+def test_scorearchive_sort_spanish(score3):
+    names = ["Zapata", "Ñúñez", "Núñez", "Álvarez", "Nuñez", "Ortiz", "nuez"]
+    scorearchive = ScoreArchive(
+        [ScoreRecord(f"José {n}", "Vals", "", score3) for n in names])
+    assert [sr.composer.split()[-1] for sr in scorearchive.sort()] == [
+        "Álvarez", "nuez", "Nuñez", "Núñez", "Ñúñez", "Ortiz", "Zapata"]
+
+def test_scorearchive_sort_editions():
+    scores = [Score(Path(p)) for p in [
+        "b/Francisco-Tárrega_Marieta.pdf",
+        "Francisco-Tárrega_Marieta_Orfeo+Tracio.pdf",
+        "a/Francisco-Tárrega_Marieta.pdf",
+        "Francisco-Tárrega_Marieta_Antich-y-Tena.pdf"]]
+    for order in (scores, scores[::-1]):
+        scorearchive = ScoreArchive.from_scores(order).sort()
+        assert [sr.score for sr in scorearchive] == [
+            scores[2], scores[0], scores[3], scores[1]]
+
+def test_collate():
+    assert collate("Tárrega") == collate("TARREGA")
+    assert collate("Núñez") < collate("Ñandú") < collate("Ortiz")
+    decomposed = unicodedata.normalize("NFD", "Muñoz")
+    assert collate(decomposed) == collate("Muñoz") > collate("Munuz")
+
+def test_scorearchive_insert_sorted(scorearchive3, scorerecord7):
+    scorearchive = ScoreArchive(scorearchive3)
+    scorearchive.remove(scorerecord7)
+    scorearchive.insert_sorted(scorerecord7)
+    assert scorearchive == scorearchive3
+
+def test_scorearchive_to_html(scorearchive1, scorearchivehtml1):
+    assert (
+        normalize_html(scorearchive1.to_html()) 
+        == normalize_html(scorearchivehtml1)
+    )
+
+
+def test_scorearchive_from_scores_with_manifest(tmp_path, scorearchive1):
+    from cache import BuildManifest
+    scores = []
+    for sr in scorearchive1:
+        pdf = tmp_path / sr.score.path
+        pdf.write_bytes(b"%PDF")
+        scores.append(Score(pdf, with_cover=False))
+    manifest = BuildManifest(tmp_path / "manifest.json")
+    scorearchive = ScoreArchive.from_scores(scores, manifest=manifest)
+    manifest.changed = False
+    assert ScoreArchive.from_scores(scores, manifest=manifest) == scorearchive
+    assert not manifest.changed
+    assert [sr.composer for sr in scorearchive] == [
+        sr.composer for sr in scorearchive1]
+
+## CoverGenerator methods
+def test_coversettings_key():
+    assert CoverSettings().key != CoverSettings(colorspace="gray").key
+
+def test_covergenerator_render(pdf, tmp_path):
+    cover = tmp_path / "cover.png"
+    placeholder, pdfinfo = CoverGenerator(pdf, cover,
+                                          CoverSettings(280, 420)).render()
+    image = Pixmap(cover)
+    assert (image.width, image.height) == (280, 420)
+    assert placeholder.startswith("data:image/png;base64,")
+    assert len(placeholder) < 500
+    assert (pdfinfo.pages, pdfinfo.width, pdfinfo.height) == (1, 600, 900)
+    assert pdfinfo.size == pdf.stat().st_size
+
+def test_covergenerator_render_1bit(pdf, tmp_path):
+    settings = CoverSettings(colorspace="gray", colors=2)
+    cover = tmp_path / "cover.png"
+    CoverGenerator(pdf, cover, settings).render()
+    assert Pixmap(cover).n == 1
+
+def test_covergenerator_render_jpeg_palette(pdf, tmp_path):
+    with pytest.raises(ValueError):
+        CoverGenerator(pdf, tmp_path / "cover.jpg",
+                       CoverSettings(colors=16)).render()
+
+def test_scorearchive_write_html(scorearchive1, tmp_path):
+    scorearchive1.write_html(tmp_path / "partituras.html")
+    html_page = (tmp_path / "partituras.html").read_text(encoding="utf-8")
+    assert html_page == scorearchive1.to_html()
+    assert [p.name for p in tmp_path.iterdir()] == ["partituras.html"]
+
+def test_scorearchive_shard(scorearchive3):
+    pages = scorearchive3.shard(page_size=2, by_composer=True)
+    assert [(p.slug, p.title) for p in pages] == [
+        ("anonimo", "Anónimo"),
+        ("carl-philipp-emanuel-bach", "Carl Philipp Emanuel Bach"),
+        ("johann-sebastian-bach", "Johann Sebastian Bach"),
+        ("francisco-tarrega", "Francisco Tárrega"),
+    ]
+    pages = scorearchive3.shard(page_size=2)
+    assert [(p.slug, len(p.scorearchive)) for p in pages] == [
+        ("1", 2), ("2", 2), ("3", 1)]
+
+def test_scorearchive_shard_unique_slugs():
+    scorearchive = ScoreArchive.from_scores(
+        Score(Path(name)) for name in ["Anónimo_Greensleeves.pdf",
+                                       "Anonimo_Romance.pdf",
+                                       "Чайковский_Вальс.pdf",
+                                       "Бах_Сарабанда.pdf"])
+    pages = scorearchive.shard(by_composer=True)
+    assert [p.slug for p in pages] == ["anonimo", "anonimo-2", "3", "4"]
+
+def test_scorearchive_write_pages(scorearchive3, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "partituras.html"
+    written = scorearchive3.write_pages(path, page_size=2)
+    assert sorted(p.name for p in written) == [
+        "partituras-1.html", "partituras-2.html", "partituras-3.html",
+        "partituras.html"]
+    assert "partituras-2.html" in (tmp_path / "partituras-1.html").read_text()
+    assert scorearchive3.write_pages(path, page_size=2) == []
+    written = scorearchive3.write_pages(path, page_size=3)
+    assert sorted(p.name for p in written) == [
+        "partituras-1.html", "partituras-2.html", "partituras.html"]
+    assert not (tmp_path / "partituras-3.html").exists()
+    remove_shards(path)
+    assert [p.name for p in tmp_path.glob("*.html")] == ["partituras.html"]
+
+def test_covergenerator_make_covers_placeholder(pdf, tmp_path):
+    from cache import CoverCache
+    score = Score(pdf, with_cover=False)
+    score.cover = tmp_path / "img" / "cover.png"
+    covercache = CoverCache(tmp_path / "covers.json")
+    CoverGenerator.make_covers([score], cache=covercache)
+    placeholder, pdfinfo = score.placeholder, score.pdfinfo
+    assert placeholder and pdfinfo
+    score.placeholder, score.pdfinfo = "", None
+    CoverGenerator.make_covers([score], cache=covercache)
+    assert score.placeholder == placeholder
+    assert score.pdfinfo == pdfinfo
+    html_page = ScoreArchive.from_scores([score]).to_html()
+    assert f'url({placeholder})' in html_page
+    assert '<p class="pages">1 págs.</p>' in html_page
+
+def test_scorerecord_compact(score3, score4):
+    scorerecord3 = ScoreRecord("Francisco " + "Tárrega", "Adelita", "", score3)
+    scorerecord4 = ScoreRecord("Francisco Tárrega", "Lágrima", "", score4)
+    assert scorerecord3.composer is scorerecord4.composer
+    assert not hasattr(scorerecord3, "__dict__")
+    assert not hasattr(score3, "__dict__")
+
+def test_blank_cover_is_no_score_cover(tmp_path):
+    for name in ["blank-score.pdf", ".blank-score.pdf"]:
+        (tmp_path / name).write_bytes(b"%PDF-1.4")
+    assert [s.cover for s in discover_scores(tmp_path, with_cover=False,
+                                             cover_format=".jpg")] == [
+        Path("img", "blank-score.jpg")]
+    assert BLANK_COVER == Path("img", ".blank-score.jpg")
+
+def test_score_does_not_render_cover(pdf, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert not Score(pdf).cover.exists()
+
+def test_coverbatch(pdf, tmp_path):
+    from cache import CoverCache
+    scores = [Score(pdf), Score(pdf)]
+    scores[0].cover = tmp_path / "img" / "first.png"
+    scores[1].cover = tmp_path / "img" / "second.png"
+    covercache = CoverCache(tmp_path / "covers.json")
+    coverbatch = CoverBatch.from_scores(
+        scores, covercache, priority=lambda s: s.cover.name != "second.png")
+    assert coverbatch.pending == [scores[1], scores[0]]
+    assert coverbatch.start(jobs=2).wait() == coverbatch.pending
+    assert all(s.cover.exists() and s.placeholder for s in scores)
+    assert CoverBatch.from_scores(scores, covercache).pending == []
+
+def test_coverbatch_renamed_pdf(pdf, tmp_path):
+    from cache import CoverCache
+    covercache = CoverCache(tmp_path / "covers.json")
+    score = Score(pdf)
+    score.cover = tmp_path / "img" / f"{pdf.stem}.png"
+    CoverBatch.from_scores([score], covercache).run()
+    renamed = Score(pdf.rename(tmp_path / "Anónimo_Greensleeves_II.pdf"))
+    renamed.cover = tmp_path / "img" / f"{renamed.path.stem}.png"
+    assert CoverBatch.from_scores([renamed], covercache).pending == []
+    assert renamed.cover.exists()
+    assert renamed.placeholder == score.placeholder != ""
+
+def test_coverbatch_failure(pdf, tmp_path):
+    broken = tmp_path / "Anónimo_Romance.pdf"
+    broken.write_bytes(b"%PDF-1.4 truncated")
+    scores = [Score(pdf), Score(broken)]
+    for s in scores:
+        s.cover = tmp_path / "img" / f"{s.name}.png"
+    coverbatch = CoverBatch.from_scores(scores)
+    assert coverbatch.run() == scores
+    assert scores[0].cover.exists() and scores[0].placeholder
+    assert scores[1].cover == BLANK_COVER
+    assert list(coverbatch.failures) == [str(broken)]
+
+def test_coverbatch_limits(pdf, tmp_path):
+    scores = [Score(pdf), Score(pdf)]
+    scores[0].cover = tmp_path / "img" / "fast.png"
+    scores[1].cover = tmp_path / "img" / "slow.png"
+    CoverBatch.from_scores(scores[:1], limits=RenderLimits(60, 2**30)).run()
+    assert scores[0].pdfinfo.pages == 1
+    coverbatch = CoverBatch.from_scores(scores[1:],
+                                        limits=RenderLimits(timeout=1e-6))
+    coverbatch.run()
+    assert scores[1].cover == BLANK_COVER
+    assert "no cover after" in coverbatch.failures[str(pdf)]
+
+def test_renderworker(pdf, tmp_path):
+    from score import RenderWorker
+    worker = RenderWorker(RenderLimits(timeout=60))
+    generators = [CoverGenerator(pdf, tmp_path / f"{i}.png")
+                  for i in range(3)]
+    worker.render(generators[0])
+    pid = worker.process.pid
+    assert worker.render(generators[1])[1].pages == 1
+    assert worker.process.pid == pid
+    worker.limits = RenderLimits(timeout=1e-6)
+    with pytest.raises(TimeoutError):
+        worker.render(generators[2])
+    assert worker.process is None
+    worker.limits = RenderLimits(timeout=60)
+    worker.render(generators[2])
+    assert worker.process.pid != pid
+    worker.stop()
+    assert all(g.cover.exists() for g in generators)
+
+def test_coverbatch_timings(pdf, tmp_path):
+    from timings import Timings
+    scores = [Score(pdf), Score(pdf)]
+    scores[0].cover = tmp_path / "img" / "inline.png"
+    scores[1].cover = tmp_path / "img" / "isolated.png"
+    timings = Timings()
+    CoverBatch.from_scores(scores[:1], timings=timings).run()
+    CoverBatch.from_scores(scores[1:], limits=RenderLimits(60),
+                           timings=timings).run()
+    assert all(s.cover.exists() and s.placeholder for s in scores)
+    assert list(timings.samples) == [
+        "cover", "cover.open", "cover.rasterize", "cover.save",
+        "cover.placeholder"]
+    for samples in timings.samples.values():
+        assert [label for _, label in samples] == [str(pdf)] * 2
+    cover, *phases = timings.samples.values()
+    assert cover[1][0] >= sum(samples[1][0] for samples in phases)
+
+def test_scorearchive_from_scores_parse_cache(scores1, tmp_path):
+    from cache import ParseCache
+    parse_cache = ParseCache(tmp_path / "names.json", parser_version())
+    scores = [Score(Path("Anónimo _ Greensleeves.pdf")), *scores1]
+    scorearchive = ScoreArchive.from_scores(scores, parse_cache=parse_cache)
+    # only the name the fast path cannot parse is memoized
+    assert list(parse_cache.entries) == [scores[0].name]
+    parse_cache.entries[scores[0].name] = {"composer": "Memo", "work": "A",
+                                           "editor": ""}
+    memoized = ScoreArchive.from_scores(scores, parse_cache=parse_cache)
+    assert memoized[0].composer == "Memo"
+    assert memoized[1:] == scorearchive[1:]
+
+def test_scorearchive_from_scores_failures(scores1, tmp_path):
+    from lark.exceptions import UnexpectedInput
+    bad = [Score(Path("Greensleeves.pdf")),
+           Score(Path("Anónimo__Romance.pdf"))]
+    with pytest.raises(UnexpectedInput):
+        ScoreArchive.from_scores(bad + scores1)
+    failures = []
+    scorearchive = ScoreArchive.from_scores(bad + scores1, failures=failures)
+    assert scorearchive == ScoreArchive.from_scores(scores1)
+    assert [(f.path, f.position, f.expected) for f in failures] == [
+        (bad[0].path, 13, ["_"]), (bad[1].path, 9, ["a word"])]
+    assert str(failures[0]) == "Greensleeves: at 13, expected _"
+
+def test_scorearchive_from_scores_timings(scores1):
+    from timings import Timings
+    timings = Timings()
+    ScoreArchive.from_scores(scores1, timings=timings)
+    assert [label for _, label in timings.samples["parse"]] == [
+        str(s.path) for s in scores1]
+
+def test_scorearchive_to_html_fragment_cache(scorearchive3, tmp_path):
+    from cache import FragmentCache
+    fragment_cache = FragmentCache(tmp_path / "fragments.json", "1")
+    html_page = scorearchive3.to_html()
+    assert scorearchive3.to_html(fragment_cache=fragment_cache) == html_page
+    assert fragment_cache.hits == 0
+    assert scorearchive3.to_html(fragment_cache=fragment_cache) == html_page
+    assert fragment_cache.hits == len(scorearchive3)
+    scorearchive3[0].score.placeholder = "data:image/png;base64,"
+    assert scorearchive3.to_html(fragment_cache=fragment_cache) \
+        == scorearchive3.to_html()
+    assert fragment_cache.misses == len(scorearchive3) + 1
+
+def test_discover_scores_covers(tmp_path):
+    for name in ["Anónimo_Greensleeves.pdf", "a/Bach_Suite.pdf",
+                 "b/Bach_Suite.pdf", "b/c/Bach_Suite.pdf"]:
+        path = tmp_path / "lib" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"%PDF")
+    covers = sorted(s.cover.as_posix()
+                    for s in discover_scores(tmp_path / "lib"))
+    assert covers == ["img/Anónimo_Greensleeves.png", "img/a/Bach_Suite.png",
+                      "img/b/Bach_Suite.png", "img/b/c/Bach_Suite.png"]
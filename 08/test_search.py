@@ -0,0 +1,58 @@
+import pytest
+from pathlib import Path
+from score import Score, ScoreArchive
+from cache import load_json
+from search import SearchIndex, fold, tokenize
+
+# Examples --------------------------------------------------------------
+@pytest.fixture
+def scorearchive1():
+    names = ["Francisco-Tárrega_Adelita.pdf",
+             "Francisco-Tárrega_Marieta_Antich-y-Tena.pdf",
+             "Anónimo_Greensleeves.pdf"]
+    return ScoreArchive.from_scores(
+        [Score(Path(name), with_cover=False) for name in names])
+
+@pytest.fixture
+def searchindex1(scorearchive1):
+    return SearchIndex.from_pages([("partituras-1.html", scorearchive1[:2]),
+                                   ("partituras-2.html", scorearchive1[2:])])
+
+# Tests -----------------------------------------------------------------
+def test_fold():
+    assert fold("Anónimo Tárrega Ñandú") == "anonimo tarrega nandu"
+
+def test_tokenize():
+    assert tokenize("Heitor Villa-Lobos, op. 35") == [
+        "heitor", "villa", "lobos", "op", "35"]
+
+def test_searchindex_from_pages(searchindex1):
+    assert searchindex1.tokens["francisco"] == [0, 1]
+    assert searchindex1.tokens["anonimo"] == [2]
+    assert searchindex1.tokens["tena"] == [1]
+    assert searchindex1.pages == [("partituras-1.html", 0),
+                                  ("partituras-2.html", 2)]
+
+def test_searchindex_shards(searchindex1):
+    shards = searchindex1.shards(2)
+    assert shards["ta"] == {"tarrega": [0, 1]}
+    assert set(shards["an"]) == {"anonimo", "antich"}
+
+def test_searchindex_write(searchindex1, tmp_path):
+    (tmp_path / "zz.json").write_text("{}")
+    written = searchindex1.write(tmp_path, prefix_length=1)
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        p.name for p in written)
+    index = load_json(tmp_path / "index.json", None)
+    assert index["prefix_length"] == 1
+    assert "t" in index["shards"]
+    assert load_json(tmp_path / "t-t.json", None) == {
+        "tarrega": [0, 1], "tena": [1]}
+
+def test_searchindex_write_index_token(tmp_path):
+    searchindex = SearchIndex({"index": [0], "indexado": [1]}, [("#", 0)])
+    searchindex.write(tmp_path, prefix_length=5)
+    index = load_json(tmp_path / "index.json", None)
+    assert index["shards"] == ["index"]
+    assert load_json(tmp_path / "t-index.json", None) == {
+        "index": [0], "indexado": [1]}
@@ -0,0 +1,56 @@
+import io
+import pytest
+from timings import Timings, format_duration, percentile
+
+# Examples --------------------------------------------------------------
+@pytest.fixture
+def timings():
+    timings = Timings()
+    timings.add("discover", 0.5)
+    for i in range(1, 21):
+        timings.add("cover", i / 100, f"{i}.pdf")
+    return timings
+
+# Tests -----------------------------------------------------------------
+def test_percentile():
+    durations = [i / 10 for i in range(1, 21)]
+    assert percentile(durations, 50) == 1.0
+    assert percentile(durations, 95) == 1.9
+    assert percentile(durations, 100) == 2.0
+    assert percentile([3.0], 50) == 3.0
+
+def test_format_duration():
+    assert format_duration(2.5) == "2.50 s"
+    assert format_duration(0.0123) == "12.3 ms"
+    assert format_duration(2.7e-6) == "2.7 µs"
+
+def test_timings_summary(timings):
+    summary = timings.summary(slowest=2)
+    assert list(summary) == ["discover", "cover"]
+    assert summary["discover"] == {"count": 1, "total": 0.5, "p50": 0.5,
+                                   "p95": 0.5, "max": 0.5, "slowest": []}
+    assert summary["cover"]["count"] == 20
+    assert summary["cover"]["total"] == pytest.approx(2.1)
+    assert (summary["cover"]["p50"], summary["cover"]["p95"],
+            summary["cover"]["max"]) == (0.1, 0.19, 0.2)
+    assert summary["cover"]["slowest"] == [["20.pdf", 0.2], ["19.pdf", 0.19]]
+
+def test_timings_measure():
+    timings = Timings()
+    with timings.measure("parse", "a.pdf"):
+        pass
+    with pytest.raises(ValueError):
+        with timings.measure("parse", "b.pdf"):
+            raise ValueError
+    assert [label for _, label in timings.samples["parse"]] == [
+        "a.pdf", "b.pdf"]
+
+def test_timings_report(timings):
+    report = io.StringIO()
+    timings.report(report, slowest=1)
+    lines = report.getvalue().splitlines()
+    assert lines[0].split() == ["stage", "count", "total", "p50", "p95",
+                                "max"]
+    assert lines[1].split()[:2] == ["discover", "1"]
+    assert lines[2].split()[:4] == ["cover", "20", "2.10", "s"]
+    assert lines[3:] == ["slowest cover:", "    200.0 ms  20.pdf"]
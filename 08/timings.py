@@ -0,0 +1,88 @@
+import math
+import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import TextIO
+
+SLOWEST = 5
+
+def percentile(durations: list[float], p: float) -> float:
+    """Return the p-th percentile of the sorted durations, by nearest
+    rank."""
+    return durations[max(0, math.ceil(p / 100 * len(durations)) - 1)]
+
+def format_duration(seconds: float) -> str:
+    """Format a duration in the most readable unit."""
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.1f} ms"
+    return f"{seconds * 1e6:.1f} µs"
+
+@dataclass
+class Timings:
+    """Durations of the stages of a build, in seconds.
+
+    A stage has one sample per run (such as discovery or writing the
+    page) or one per file (such as parsing a name or rendering a cover),
+    labelled with the file so the slowest ones can be reported. Stages
+    are kept in the order they are first timed."""
+    samples: dict[str, list[tuple[float, str]]] = field(default_factory=dict)
+
+    def add(self, stage: str, seconds: float, label: str = "") -> None:
+        """Add a sample of seconds to stage."""
+        self.samples.setdefault(stage, []).append((seconds, label))
+
+    def add_phases(self, phases: dict[str, float], label: str = "") -> None:
+        """Add a sample to each stage of phases."""
+        for stage, seconds in phases.items():
+            self.add(stage, seconds, label)
+
+    @contextmanager
+    def measure(self, stage: str, label: str = "") -> Iterator[None]:
+        """Add the time spent in the with block to stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, label)
+
+    def summary(self, slowest: int = SLOWEST) -> dict[str, dict]:
+        """Return the count, total, p50, p95 and max of each stage, and
+        its slowest labelled samples."""
+        summary = {}
+        for stage, samples in self.samples.items():
+            durations = sorted(seconds for seconds, _ in samples)
+            labelled = sorted((s for s in samples if s[1]), reverse=True)
+            summary[stage] = {
+                "count": len(durations),
+                "total": math.fsum(durations),
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "max": durations[-1],
+                "slowest": [[label, seconds]
+                            for seconds, label in labelled[:slowest]],
+            }
+        return summary
+
+    def report(self, file: TextIO = sys.stderr,
+               slowest: int = SLOWEST) -> None:
+        """Print the summary as a table, with the slowest files of each
+        stage timed per file."""
+        summary = self.summary(slowest)
+        width = max(map(len, summary), default=0)
+        print(f"{'stage':<{width}} {'count':>7} {'total':>10} {'p50':>10} "
+              f"{'p95':>10} {'max':>10}", file=file)
+        for stage, s in summary.items():
+            print(f"{stage:<{width}} {s['count']:>7} "
+                  + " ".join(f"{format_duration(s[k]):>10}"
+                             for k in ("total", "p50", "p95", "max")),
+                  file=file)
+        for stage, s in summary.items():
+            if s["count"] > 1 and s["slowest"]:
+                print(f"slowest {stage}:", file=file)
+                for label, seconds in s["slowest"]:
+                    print(f"  {format_duration(seconds):>10}  {label}",
+                          file=file)